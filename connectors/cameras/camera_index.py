@@ -6,8 +6,9 @@ Loads all brand JSON files and builds an in-memory search index
 
 import json
 import os
+from collections import defaultdict
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 
 
@@ -27,6 +28,9 @@ class CameraIndex:
     def __init__(self):
         self.models: List[CameraModel] = []
         self._loaded = False
+        # Lazily built search index (see _build_search_index)
+        self._brand_models: Optional[Dict[str, List[int]]] = None
+        self._model_trigrams: Optional[Dict[str, List[int]]] = None
 
     def load(self, data_dir: str = None):
         """Load all brand JSON files into memory"""
@@ -74,6 +78,8 @@ class CameraIndex:
                 continue
 
         self._loaded = True
+        self._brand_models = None
+        self._model_trigrams = None
         print(f"Loaded {len(self.models)} camera models from {len(list(data_dir.glob('*.json')))} brand files")
 
     def search(self, query: str, limit: int = 50) -> List[Dict[str, Any]]:
@@ -98,8 +104,14 @@ class CameraIndex:
         results = []
         seen_displays = set()
 
-        # Search through all models
-        for camera_model in self.models:
+        # Search through all models, or only the indexed candidates
+        candidate_ids = self._candidate_ids(query_lower)
+        if candidate_ids is None:
+            candidates = self.models
+        else:
+            candidates = [self.models[i] for i in candidate_ids]
+
+        for camera_model in candidates:
             # Check if query matches brand or model
             brand_lower = camera_model.brand.lower()
             model_lower = camera_model.model.lower()
@@ -139,6 +151,63 @@ class CameraIndex:
         # Combine: unlisted first, then matches
         return unlisted_options + results
 
+    def _build_search_index(self):
+        """Index model ids by lower-cased brand and by model-name trigram"""
+        brand_models = defaultdict(list)
+        model_trigrams = defaultdict(list)
+
+        for model_id, camera_model in enumerate(self.models):
+            brand_models[camera_model.brand.lower()].append(model_id)
+
+            name = camera_model.model.lower()
+            for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                model_trigrams[trigram].append(model_id)
+
+        self._brand_models = dict(brand_models)
+        self._model_trigrams = dict(model_trigrams)
+
+    def _candidate_ids(self, query_lower: str) -> Optional[List[int]]:
+        """
+        Get ids of models that may match query_lower, in load order
+
+        Returns None for queries shorter than a trigram; those are matched
+        by scanning every model. Candidates are a superset of the matches,
+        so callers still check the query against brand and model.
+        """
+        if len(query_lower) < 3:
+            return None
+
+        if self._model_trigrams is None:
+            self._build_search_index()
+
+        # Models whose brand contains the query (there are far fewer brands
+        # than models, so a scan is cheap here)
+        candidates = set()
+        for brand_lower, model_ids in self._brand_models.items():
+            if query_lower in brand_lower:
+                candidates.update(model_ids)
+
+        # Models whose name contains every trigram of the query; start from
+        # the shortest posting list so the intersection stays small
+        postings = []
+        for trigram in {query_lower[i:i + 3] for i in range(len(query_lower) - 2)}:
+            posting = self._model_trigrams.get(trigram)
+            if posting is None:
+                postings = None
+                break
+            postings.append(posting)
+
+        if postings:
+            postings.sort(key=len)
+            name_matches = set(postings[0])
+            for posting in postings[1:]:
+                name_matches.intersection_update(posting)
+                if not name_matches:
+                    break
+            candidates |= name_matches
+
+        return sorted(candidates)
+
     def get_entries_for_model(self, brand: str, model: str) -> List[Dict[str, Any]]:
         """
         Get all URL pattern entries for a specific brand and model
@@ -5,7 +5,8 @@ Authentication API endpoints
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
+import jwt
+from jwt import PyJWTError
 from passlib.context import CryptContext
 import os
 
@@ -62,7 +63,7 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
                 detail="Could not validate credentials",
             )
         return {"username": username}
-    except JWTError:
+    except PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
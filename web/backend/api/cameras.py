@@ -5,7 +5,9 @@ Provides search and stream scanning functionality
 
 import logging
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+import orjson
 from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
@@ -20,6 +22,23 @@ camera_index = CameraIndexService()
 stream_scanner = CameraStreamScanner()
 
 
+def _sse_frame(event: Dict[str, Any]) -> Optional[bytes]:
+    """Encode a scanner event as SSE bytes"""
+    event_type = event["type"]
+    if event_type == "stream_found_batch":
+        # One write for the whole batch; clients still see one data frame
+        # per stream
+        return b"".join(b"data: " + stream_data + b"\n\n" for stream_data in event["data"])
+    if event_type == "heartbeat":
+        # SSE comment frame keeps proxies from closing the connection
+        return b": heartbeat\n\n"
+    if event_type == "scan_complete":
+        return b'data: {"type": "done"}\n\n'
+    if event_type == "error":
+        return b"data: " + orjson.dumps({"type": "error", "message": event["message"]}) + b"\n\n"
+    return None
+
+
 class StreamScanRequest(BaseModel):
     """Request to start stream scanning"""
     model: str
@@ -104,14 +123,10 @@ async def stream_scan_results(task_id: str):
         async def event_generator():
             """Generate SSE events for scan progress"""
             async for event in stream_scanner.get_results_stream(task_id):
-                if event["type"] == "stream_found":
-                    stream_data = event["data"]
-                    yield f"data: {stream_data}\n\n"
-                elif event["type"] == "scan_complete":
-                    yield 'data: {"type": "done"}\n\n'
-                    break
-                elif event["type"] == "error":
-                    yield f'data: {{"type": "error", "message": "{event["message"]}"}}\n\n'
+                frame = _sse_frame(event)
+                if frame:
+                    yield frame
+                if event["type"] in ("scan_complete", "error"):
                     break
 
         return StreamingResponse(
@@ -129,13 +144,26 @@ async def stream_scan_results(task_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.delete("/scan-streams/{task_id}")
+async def cancel_stream_scan(task_id: str) -> Dict[str, Any]:
+    """
+    Cancel a running scan
+
+    Connected SSE clients receive an error event and the stream closes
+    """
+    if not stream_scanner.cancel_scan(task_id):
+        raise HTTPException(status_code=404, detail="No running scan with this task id")
+
+    return {"ok": True, "task_id": task_id}
+
+
 @router.get("/scan-streams/{task_id}/status")
 async def get_scan_status(task_id: str) -> Dict[str, Any]:
     """
     Get current status of a scan task (alternative to SSE)
 
     Returns:
-        - status: "running", "completed", "error"
+        - status: "running", "completed", "error", "cancelled"
         - found_streams: list of discovered streams
         - progress: percentage complete
     """
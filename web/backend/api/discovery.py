@@ -10,8 +10,9 @@ import logging
 import requests
 import os
 from datetime import datetime
+from pathlib import Path
 from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, BackgroundTasks
 from pydantic import BaseModel, Field
 
 from services.config_service import ConfigService
@@ -26,6 +27,11 @@ config_service = ConfigService()
 docker_service = DockerService()
 
 
+def get_discovered_path() -> Path:
+    """Path of the discovered devices file, overridable per app"""
+    return config_service.discovered_devices_path
+
+
 class DiscoveredDevice(BaseModel):
     """Discovered device model"""
     id: str
@@ -67,11 +73,9 @@ class ScanRequest(BaseModel):
 
 
 @router.get("/devices", response_model=List[DiscoveredDevice])
-async def get_discovered_devices():
+async def get_discovered_devices(discovered_path: Path = Depends(get_discovered_path)):
     """Get all discovered devices"""
     try:
-        discovered_path = config_service.discovered_devices_path
-        
         if not discovered_path.exists():
             return []
         
@@ -89,12 +93,14 @@ async def get_discovered_devices():
 
 
 @router.post("/devices/{device_id}/add")
-async def add_discovered_device(device_id: str, request: AddDeviceRequest):
+async def add_discovered_device(
+    device_id: str,
+    request: AddDeviceRequest,
+    discovered_path: Path = Depends(get_discovered_path)
+):
     """Add a discovered device to the system"""
     try:
         # Load discovered devices
-        discovered_path = config_service.discovered_devices_path
-        
         if not discovered_path.exists():
             raise HTTPException(status_code=404, detail="No discovered devices found")
         
@@ -366,11 +372,9 @@ async def run_discovery_for_integration(integration: str):
 
 
 @router.get("/status")
-async def get_discovery_status():
+async def get_discovery_status(discovered_path: Path = Depends(get_discovered_path)):
     """Get current discovery status"""
     try:
-        discovered_path = config_service.discovered_devices_path
-        
         if not discovered_path.exists():
             return {
                 "status": "idle",
@@ -403,14 +407,12 @@ async def get_discovery_status():
 
 
 @router.websocket("/ws")
-async def discovery_websocket(websocket: WebSocket):
+async def discovery_websocket(websocket: WebSocket, discovered_path: Path = Depends(get_discovered_path)):
     """WebSocket endpoint for real-time discovery updates"""
     await websocket.accept()
     
     try:
         # Send initial state
-        discovered_path = config_service.discovered_devices_path
-        
         if discovered_path.exists():
             with open(discovered_path, 'r') as f:
                 data = json.load(f)
@@ -439,11 +441,9 @@ async def discovery_websocket(websocket: WebSocket):
 
 
 @router.delete("/devices/{device_id}")
-async def remove_discovered_device(device_id: str):
+async def remove_discovered_device(device_id: str, discovered_path: Path = Depends(get_discovered_path)):
     """Remove a device from discovered list"""
     try:
-        discovered_path = config_service.discovered_devices_path
-        
         if not discovered_path.exists():
             raise HTTPException(status_code=404, detail="No discovered devices")
         
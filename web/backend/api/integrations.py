@@ -294,7 +294,7 @@ async def clear_all_mqtt_topics():
             raise HTTPException(status_code=503, detail="MQTT service not available")
         
         # Clear all topics
-        success = mqtt_service.clear_all_iot2mqtt_topics()
+        success = await mqtt_service.clear_all_iot2mqtt_topics_async()
         
         if success:
             return {
@@ -319,7 +319,7 @@ async def clear_instance_mqtt_topics(instance_id: str):
             raise HTTPException(status_code=503, detail="MQTT service not available")
         
         # Clear instance topics
-        success = mqtt_service.clear_instance_topics(instance_id)
+        success = await mqtt_service.clear_instance_topics_async(instance_id)
         
         if success:
             return {
@@ -366,7 +366,7 @@ async def delete_instance(instance_id: str):
         if mqtt_service and mqtt_service.connected:
             try:
                 # Use the comprehensive cleanup method
-                mqtt_service.clear_instance_topics(instance_id)
+                await mqtt_service.clear_instance_topics_async(instance_id)
                 logger.info(f"Cleared all MQTT topics for instance {instance_id}")
             except Exception as e:
                 logger.warning(f"Failed to clear MQTT topics for {instance_id}: {e}")
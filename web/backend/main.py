@@ -16,7 +16,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import socketio
-from jose import JWTError, jwt
+import jwt
+from jwt import PyJWTError
 from passlib.context import CryptContext
 import uvicorn
 
@@ -85,6 +86,7 @@ async def lifespan(app: FastAPI):
     # Cleanup
     if mqtt_service:
         mqtt_service.disconnect()
+    await cameras.stream_scanner.shutdown()
 
 
 # Create FastAPI app
@@ -140,7 +142,7 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
-    except JWTError:
+    except PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
@@ -447,7 +449,7 @@ async def container_logs_websocket(websocket: WebSocket, container_id: str, toke
     # Verify token
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
+    except PyJWTError:
         await websocket.close(code=1008, reason="Invalid token")
         return
     
@@ -539,7 +541,7 @@ async def mqtt_websocket(websocket: WebSocket, token: str = Query(...)):
     # Verify token
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    except JWTError:
+    except PyJWTError:
         await websocket.close(code=1008, reason="Invalid token")
         return
     
@@ -560,7 +562,7 @@ async def mqtt_websocket(websocket: WebSocket, token: str = Query(...)):
                     "type": "update",
                     "topic": topic,
                     "value": payload,
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": mqtt_service.iso_timestamp(),
                     "retained": retained
                 })
         except:
@@ -4,24 +4,102 @@ Asynchronously tests camera stream URLs and broadcasts results via SSE
 """
 
 import asyncio
-import json
+import bisect
 import logging
+import re
 import subprocess
-from typing import Dict, List, Any, AsyncGenerator
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, AsyncGenerator, Iterator, Optional, Sequence, Tuple
 from urllib.parse import urlparse
 from datetime import datetime
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
+# "scheme://" followed by the userinfo part of the authority, up to its last "@"
+_CREDENTIALS_RE = re.compile(r"(?P<scheme>[a-z][a-z0-9+.-]*://)[^/?#\s]*@", re.IGNORECASE)
+
+# Events buffered per scan for its SSE client, and how long a producer
+# waits for a slow client before dropping an event
+SSE_QUEUE_SIZE = 256
+SSE_PUT_TIMEOUT = 0.5
+
+# Streams found within this many seconds of each other are sent to the SSE
+# client as one stream_found_batch event
+SSE_BATCH_WINDOW = 0.05
+
+# Seconds between heartbeats while a scan is quiet, and seconds without any
+# result after which the SSE stream gives up
+SSE_HEARTBEAT_INTERVAL = 15
+SCAN_IDLE_TIMEOUT = 300
+
+# Scans probing at the same time; each one runs up to 10 probes
+MAX_CONCURRENT_SCANS = 8
+
+
+@dataclass
+class ScanState:
+    """Per-scan state shared by the scan task, SSE stream and status API"""
+    queue: Optional[asyncio.Queue] = None  # Dropped once the SSE stream ends
+    results: Optional[List[Dict[str, Any]]] = field(default_factory=list)  # Kept in priority order
+    status: Optional[str] = "running"  # "running", "completed", "error", "cancelled"
+    # Found streams waiting for the batch window to close
+    pending_streams: List[Dict[str, Any]] = field(default_factory=list)
+    flush_task: Optional[asyncio.Task] = None
+
+
+class _ScanFieldView(MutableMapping):
+    """Dict-like view of one ScanState field across all scans; None means unset"""
+
+    def __init__(self, scans: Dict[str, ScanState], attr: str):
+        self._scans = scans
+        self._attr = attr
+
+    def __getitem__(self, task_id: str) -> Any:
+        value = getattr(self._scans[task_id], self._attr)
+        if value is None:
+            raise KeyError(task_id)
+        return value
+
+    def __setitem__(self, task_id: str, value: Any):
+        state = self._scans.get(task_id)
+        if state is None:
+            state = self._scans[task_id] = ScanState(results=None, status=None)
+        setattr(state, self._attr, value)
+
+    def __delitem__(self, task_id: str):
+        self[task_id]
+        setattr(self._scans[task_id], self._attr, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return (task_id for task_id, state in self._scans.items() if getattr(state, self._attr) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
 
 class CameraStreamScanner:
     """Manages asynchronous camera stream scanning tasks"""
 
+    # Probe order by stream type (lower = higher priority)
+    _PRIORITY_TABLE = {
+        "ONVIF": 1,
+        "FFMPEG": 2,
+        "MJPEG": 3,
+        "JPEG": 4,
+        "VLC": 5
+    }
+
     def __init__(self):
         self.active_scans: Dict[str, asyncio.Task] = {}
-        self.scan_results: Dict[str, List[Dict[str, Any]]] = {}
-        self.scan_status: Dict[str, str] = {}  # "running", "completed", "error"
-        self.scan_queues: Dict[str, asyncio.Queue] = {}
+        self.scans: Dict[str, ScanState] = {}
+        # Per-field views over self.scans
+        self.scan_results = _ScanFieldView(self.scans, "results")
+        self.scan_status = _ScanFieldView(self.scans, "status")
+        self.scan_queues = _ScanFieldView(self.scans, "queue")
+        self._scan_slots = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
 
     async def start_scan(
         self,
@@ -48,9 +126,7 @@ class CameraStreamScanner:
             return
 
         # Create queue for results
-        self.scan_queues[task_id] = asyncio.Queue()
-        self.scan_results[task_id] = []
-        self.scan_status[task_id] = "running"
+        self.scans[task_id] = ScanState(queue=asyncio.Queue(maxsize=SSE_QUEUE_SIZE))
 
         # Start scanning task
         task = asyncio.create_task(
@@ -68,57 +144,152 @@ class CameraStreamScanner:
         channel: int
     ):
         """Internal method to perform stream scanning"""
+        state = self.scans[task_id]
         try:
-            # Generate test URLs from entries
-            test_urls = self._generate_test_urls(entries, address, username, password, channel)
+            # Bound how many scans probe at once; later ones wait their turn
+            async with self._scan_slots:
+                # Generate test URLs from entries
+                test_urls = self._generate_test_urls(entries, address, username, password, channel)
 
-            logger.info(f"Scanning {len(test_urls)} URLs for task {task_id}")
+                logger.info(f"Scanning {len(test_urls)} URLs for task {task_id}")
 
-            # Test URLs in parallel (with concurrency limit)
-            semaphore = asyncio.Semaphore(10)  # Max 10 concurrent tests
+                # Test URLs in parallel (with concurrency limit)
+                semaphore = asyncio.Semaphore(10)  # Max 10 concurrent tests
 
-            async def test_with_semaphore(url_info):
-                async with semaphore:
-                    return await self._test_stream(url_info)
+                async def test_with_semaphore(url_info):
+                    async with semaphore:
+                        return await self._test_stream(url_info)
 
-            # Create tasks for all URLs
-            tasks = [test_with_semaphore(url_info) for url_info in test_urls]
+                # Create tasks for all URLs
+                tasks = [asyncio.create_task(test_with_semaphore(url_info)) for url_info in test_urls]
 
-            # Process results as they complete
-            for coro in asyncio.as_completed(tasks):
-                result = await coro
+                try:
+                    # Process results as they complete
+                    for coro in asyncio.as_completed(tasks):
+                        result = await coro
 
-                if result["ok"]:
-                    stream_data = result["stream"]
+                        if result["ok"]:
+                            stream_data = result["stream"]
 
-                    # Add to results
-                    self.scan_results[task_id].append(stream_data)
+                            # Add to results, keeping them in priority order so
+                            # get_status never has to sort
+                            bisect.insort(state.results, stream_data, key=self._stream_priority)
 
-                    # Send to queue for SSE
-                    await self.scan_queues[task_id].put({
-                        "type": "stream_found",
-                        "data": json.dumps(stream_data)
-                    })
+                            # Send to queue for SSE
+                            self._queue_stream(task_id, stream_data)
+                finally:
+                    # Don't leave probes (and their subprocesses) running if the
+                    # scan fails or is cancelled part way through
+                    for task in tasks:
+                        task.cancel()
 
             # Mark as complete
-            self.scan_status[task_id] = "completed"
-            await self.scan_queues[task_id].put({"type": "scan_complete"})
+            state.status = "completed"
+            await self._flush_streams(task_id)
+            self._publish_final_event(task_id, {"type": "scan_complete"})
 
-            logger.info(f"Scan {task_id} completed. Found {len(self.scan_results[task_id])} streams")
+            logger.info(f"Scan {task_id} completed. Found {len(state.results)} streams")
+
+        except asyncio.CancelledError:
+            logger.info(f"Scan {task_id} cancelled")
+            state.status = "cancelled"
+            self._publish_final_event(task_id, {
+                "type": "error",
+                "message": "Scan cancelled"
+            })
+            raise
 
         except Exception as e:
             logger.error(f"Scan {task_id} failed: {e}")
-            self.scan_status[task_id] = "error"
-            await self.scan_queues[task_id].put({
+            state.status = "error"
+            await self._flush_streams(task_id)
+            self._publish_final_event(task_id, {
                 "type": "error",
                 "message": str(e)
             })
 
         finally:
             # Cleanup
+            if state.flush_task:
+                state.flush_task.cancel()
+                state.flush_task = None
             if task_id in self.active_scans:
                 del self.active_scans[task_id]
 
+    def cancel_scan(self, task_id: str) -> bool:
+        """
+        Cancel a running or queued scan
+
+        Returns: True if the scan was still active
+        """
+        task = self.active_scans.get(task_id)
+        if task is None:
+            return False
+
+        task.cancel()
+        return True
+
+    async def shutdown(self):
+        """Cancel all active scans and wait for them to stop"""
+        tasks = list(self.active_scans.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _queue_stream(self, task_id: str, stream_data: Dict[str, Any]):
+        """Buffer a found stream, starting the batch window if none is open"""
+        state = self.scans[task_id]
+        state.pending_streams.append(stream_data)
+        if state.flush_task is None:
+            state.flush_task = asyncio.create_task(self._flush_streams_later(task_id))
+
+    async def _flush_streams_later(self, task_id: str):
+        """Publish buffered streams once the batch window closes"""
+        await asyncio.sleep(SSE_BATCH_WINDOW)
+        self.scans[task_id].flush_task = None
+        await self._flush_streams(task_id)
+
+    async def _flush_streams(self, task_id: str):
+        """Publish buffered streams now as a single stream_found_batch event"""
+        state = self.scans[task_id]
+        if state.flush_task:
+            state.flush_task.cancel()
+            state.flush_task = None
+
+        if not state.pending_streams:
+            return
+
+        streams, state.pending_streams = state.pending_streams, []
+        await self._publish_event(task_id, {
+            "type": "stream_found_batch",
+            # Serialized once here; the SSE endpoint writes the bytes as is
+            "data": [orjson.dumps(stream_data) for stream_data in streams]
+        })
+
+    async def _publish_event(self, task_id: str, event: Dict[str, Any]):
+        """Queue an event for the SSE client, dropping it if the client is stuck"""
+        state = self.scans.get(task_id)
+        queue = state.queue if state else None
+        if queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(queue.put(event), timeout=SSE_PUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Results are still kept in the scan state for the status API
+            logger.warning(f"SSE queue full for scan {task_id}, dropping {event['type']} event")
+
+    def _publish_final_event(self, task_id: str, event: Dict[str, Any]):
+        """Queue a terminal event, evicting the oldest one if the queue is full"""
+        state = self.scans.get(task_id)
+        queue = state.queue if state else None
+        if queue is None:
+            return
+
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
     def _generate_test_urls(
         self,
         entries: List[Dict[str, Any]],
@@ -133,6 +304,7 @@ class CameraStreamScanner:
         Returns list of dicts with: {url, type, protocol, port, notes}
         """
         test_urls = []
+        seen_urls = set()
 
         # Parse address to extract IP and port
         parsed = urlparse(address if '://' in address else f'http://{address}')
@@ -173,6 +345,11 @@ class CameraStreamScanner:
             else:
                 full_url = f"{protocol}://{host}:{port}/{url_path.lstrip('/')}"
 
+            # Different entries often expand to the same URL; probe it once
+            if full_url in seen_urls:
+                continue
+            seen_urls.add(full_url)
+
             test_urls.append({
                 "url": full_url,
                 "type": entry.get("type", "FFMPEG"),
@@ -189,14 +366,11 @@ class CameraStreamScanner:
 
     def _get_priority(self, stream_type: str) -> int:
         """Get priority for stream type (lower = higher priority)"""
-        priorities = {
-            "ONVIF": 1,
-            "FFMPEG": 2,
-            "MJPEG": 3,
-            "JPEG": 4,
-            "VLC": 5
-        }
-        return priorities.get(stream_type, 99)
+        return self._PRIORITY_TABLE.get(stream_type, 99)
+
+    def _stream_priority(self, stream_data: Dict[str, Any]) -> int:
+        """Get priority of a found stream"""
+        return self._PRIORITY_TABLE.get(stream_data.get("type"), 99)
 
     async def _test_stream(self, url_info: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -226,21 +400,17 @@ class CameraStreamScanner:
 
         try:
             # Run ffprobe with timeout
-            proc = await asyncio.create_subprocess_exec(
+            returncode, stdout = await self._run_probe([
                 "ffprobe",
                 "-v", "error",
                 "-rtsp_transport", "tcp",
                 "-timeout", "5000000",  # 5 second timeout
                 "-print_format", "json",
                 "-show_streams",
-                url,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=10)
+                url
+            ], timeout=10)
 
-            if proc.returncode == 0 and stdout:
+            if returncode == 0 and stdout:
                 # Stream is accessible
                 return {
                     "ok": True,
@@ -269,7 +439,7 @@ class CameraStreamScanner:
 
         try:
             # Simple HEAD request to check if URL is accessible
-            proc = await asyncio.create_subprocess_exec(
+            _, stdout = await self._run_probe([
                 "curl",
                 "-I",  # HEAD request
                 "-s",  # Silent
@@ -277,12 +447,8 @@ class CameraStreamScanner:
                 "-w", "%{http_code}",
                 "--connect-timeout", "5",
                 "--max-time", "10",
-                url,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-
-            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=15)
+                url
+            ], timeout=15)
             status_code = stdout.decode().strip()
 
             if status_code.startswith("200"):
@@ -305,62 +471,81 @@ class CameraStreamScanner:
 
         return {"ok": False, "stream": None}
 
+    async def _run_probe(self, args: Sequence[str], timeout: float) -> Tuple[int, bytes]:
+        """
+        Run a probe command and collect its stdout
+
+        The process is killed if it outlives timeout or the probe is
+        cancelled, so timed-out probes don't linger in the background.
+
+        Returns: (returncode, stdout)
+        """
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        except BaseException:
+            if proc.returncode is None:
+                proc.kill()
+            raise
+
+        return proc.returncode, stdout
+
     def _mask_credentials(self, url: str) -> str:
         """Mask username and password in URL"""
-        try:
-            parsed = urlparse(url)
-            if parsed.username or parsed.password:
-                # Replace credentials with ***
-                masked = parsed._replace(
-                    netloc=f"***:***@{parsed.hostname}:{parsed.port}" if parsed.port
-                    else f"***:***@{parsed.hostname}"
-                )
-                return masked.geturl()
-            return url
-        except:
-            return url
+        return _CREDENTIALS_RE.sub(r"\g<scheme>***:***@", url, count=1)
 
     async def get_results_stream(self, task_id: str) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Get SSE event stream for scan results
 
-        Yields events: {"type": "stream_found", "data": {...}} or {"type": "scan_complete"}
+        Yields events: {"type": "stream_found_batch", "data": [<JSON bytes>, ...]} or {"type": "scan_complete"},
+        plus {"type": "heartbeat"} while no result arrives for a while
         """
-        if task_id not in self.scan_queues:
+        state = self.scans.get(task_id)
+        if state is None or state.queue is None:
             yield {"type": "error", "message": "Scan not found"}
             return
 
-        queue = self.scan_queues[task_id]
+        queue = state.queue
+        loop = asyncio.get_running_loop()
+        idle_deadline = loop.time() + SCAN_IDLE_TIMEOUT
 
         while True:
             try:
-                # Wait for next result (with timeout)
-                event = await asyncio.wait_for(queue.get(), timeout=300)  # 5 min max
-
-                yield event
-
-                if event["type"] in ["scan_complete", "error"]:
+                # Wait for next result, waking up periodically so the client
+                # can be sent a heartbeat
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                if loop.time() >= idle_deadline:
+                    yield {"type": "error", "message": "Scan timeout"}
                     break
+                yield {"type": "heartbeat"}
+                continue
 
-            except asyncio.TimeoutError:
-                yield {"type": "error", "message": "Scan timeout"}
+            yield event
+
+            if event["type"] in ["scan_complete", "error"]:
                 break
+            idle_deadline = loop.time() + SCAN_IDLE_TIMEOUT
 
-        # Cleanup
-        if task_id in self.scan_queues:
-            del self.scan_queues[task_id]
-        if task_id in self.scan_results:
-            # Keep results for a bit longer for status API
-            pass
+        # Cleanup; results and status are kept for the status API
+        state.queue = None
 
     def get_status(self, task_id: str) -> Dict[str, Any]:
-        """Get current status of a scan"""
-        if task_id not in self.scan_status:
+        """Get current status of a scan; found_streams are ordered by priority"""
+        state = self.scans.get(task_id)
+        if state is None or state.status is None:
             raise ValueError(f"Task {task_id} not found")
 
+        found_streams = state.results or []
         return {
             "task_id": task_id,
-            "status": self.scan_status[task_id],
-            "found_streams": self.scan_results.get(task_id, []),
-            "count": len(self.scan_results.get(task_id, []))
+            "status": state.status,
+            "found_streams": found_streams,
+            "count": len(found_streams)
         }
@@ -2,20 +2,50 @@
 Configuration management service with file locking
 """
 
+import copy
 import os
-import json
+import errno
 import yaml
+import orjson
 import fcntl
+import functools
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from types import MappingProxyType
+from typing import Dict, Any, Iterator, Mapping, Optional, List, Tuple
 from contextlib import contextmanager
 import shutil
 from datetime import datetime
 import logging
-from .secrets_manager import SecretsManager
+from .secrets_manager import get_secrets_manager
 
 logger = logging.getLogger(__name__)
 
+# Branding for connectors whose setup.json has none; shared, hence read-only
+_DEFAULT_BRANDING: Mapping[str, str] = MappingProxyType({
+    "icon": "/assets/default-icon.svg",
+    "color": "#6366F1",  # Default indigo
+    "background": "linear-gradient(135deg, #667eea 0%, #764ba2 100%)",
+    "category": "general"
+})
+
+
+@functools.lru_cache(maxsize=128)
+def _load_setup_cached(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a connector setup.json; the mtime in the key invalidates edited files"""
+    with open(path, 'rb') as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        return orjson.loads(f.read())
+
+
+@functools.lru_cache(maxsize=4)
+def _detect_base_path_cached(module_file: str, cwd: str) -> Path:
+    """Walk up from module_file to the directory holding docker-compose.yml"""
+    for parent in Path(module_file).resolve().parents:
+        # docker-compose.yml lives in repo root and inside container at /app
+        if (parent / "docker-compose.yml").exists():
+            return parent
+    return Path(cwd)
+
 
 class ConfigService:
     """Service for managing configurations with file locking"""
@@ -41,16 +71,12 @@ class ConfigService:
         self.instances_path.mkdir(parents=True, exist_ok=True)
         self.secrets_path.mkdir(parents=True, exist_ok=True)
 
-        self.secrets_manager = SecretsManager(str(self.secrets_path))
+        self.secrets_manager = get_secrets_manager(str(self.secrets_path))
     
     def _detect_base_path(self) -> Path:
         """Detect project base path when not explicitly provided"""
-        candidate = Path(__file__).resolve()
-        for parent in candidate.parents:
-            # docker-compose.yml lives in repo root and inside container at /app
-            if (parent / "docker-compose.yml").exists():
-                return parent
-        return Path.cwd()
+        # The layout doesn't change while the process runs, so only walk it once
+        return _detect_base_path_cached(__file__, os.getcwd())
     
     def _detect_frontend_dist_path(self) -> Path:
         """Locate built frontend assets directory"""
@@ -67,15 +93,32 @@ class ConfigService:
         
     @contextmanager
     def locked_file(self, filepath: Path, mode: str = 'r+'):
-        """Context manager for file locking"""
+        """
+        Context manager for file locking
+
+        Read-only modes take a shared lock so readers don't block each other;
+        any other mode takes an exclusive lock.
+        """
+        lock = fcntl.LOCK_SH if mode in ('r', 'rb') else fcntl.LOCK_EX
         file = None
         try:
             # Ensure file exists for r+ mode
-            if mode == 'r+' and not filepath.exists():
+            if mode in ('r+', 'r+b') and not filepath.exists():
                 filepath.touch()
                 
-            file = open(filepath, mode)
-            fcntl.flock(file, fcntl.LOCK_EX)  # Exclusive lock
+            while True:
+                file = open(filepath, mode)
+                fcntl.flock(file, lock)
+                # Writers swap files in with os.replace; if that happened while
+                # we waited, the lock is held on the old inode, so retry
+                try:
+                    if os.fstat(file.fileno()).st_ino == os.stat(filepath).st_ino:
+                        break
+                except FileNotFoundError:
+                    break
+                fcntl.flock(file, fcntl.LOCK_UN)
+                file.close()
+                file = None
             yield file
         finally:
             if file:
@@ -85,11 +128,11 @@ class ConfigService:
     @contextmanager
     def locked_json_file(self, filepath: Path):
         """Context manager for locked JSON file operations"""
-        with self.locked_file(filepath, 'r+') as f:
+        with self.locked_file(filepath, 'r+b') as f:
             try:
                 content = f.read()
-                data = json.loads(content) if content else {}
-            except json.JSONDecodeError:
+                data = orjson.loads(content) if content else {}
+            except orjson.JSONDecodeError:
                 data = {}
             
             # Create a mutable container for the data
@@ -97,9 +140,42 @@ class ConfigService:
             yield container
             
             # Write back the data
-            f.seek(0)
-            json.dump(container['data'], f, indent=2)
-            f.truncate()
+            self._replace_file(
+                filepath,
+                orjson.dumps(container['data'], option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            )
+
+    def _replace_file(self, filepath: Path, content: bytes):
+        """Atomically replace filepath with content; caller must hold its lock"""
+        tmp_file = filepath.with_name(filepath.name + '.tmp')
+        with open(tmp_file, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        try:
+            shutil.copymode(filepath, tmp_file)
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.replace(tmp_file, filepath)
+        except OSError as e:
+            # Single-file bind mounts (e.g. .env in docker-compose) can't be
+            # renamed over, so fall back to rewriting them in place
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            with open(filepath, 'wb') as f:
+                f.write(content)
+            tmp_file.unlink()
+            return
+
+        # The rename is only durable once the directory entry is synced
+        fd = os.open(filepath.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
     
     def load_env(self) -> Dict[str, str]:
         """Load environment variables from .env file"""
@@ -125,37 +201,41 @@ class ConfigService:
             backup = self.env_file.with_suffix(f'.env.{datetime.now().strftime("%Y%m%d_%H%M%S")}.bak')
             shutil.copy(self.env_file, backup)
         
-        with self.locked_file(self.env_file, 'w') as f:
-            f.write("# IoT2MQTT Configuration\n")
-            f.write(f"# Generated at {datetime.now().isoformat()}\n\n")
-            
-            # Group related variables
-            groups = {
-                "Web Interface": ["WEB_ACCESS_KEY", "WEB_PORT"],
-                "MQTT Broker Settings": ["MQTT_HOST", "MQTT_PORT", "MQTT_USERNAME", "MQTT_PASSWORD"],
-                "MQTT Topics and Client": ["MQTT_BASE_TOPIC", "MQTT_CLIENT_PREFIX", "MQTT_QOS", "MQTT_RETAIN"],
-                "Home Assistant Discovery": ["HA_DISCOVERY_ENABLED", "HA_DISCOVERY_PREFIX"],
-                "Advanced Settings": ["MQTT_KEEPALIVE", "MQTT_CLEAN_SESSION", "RESPONSE_TIMEOUT", "MAX_RETRIES"]
-            }
-            
-            written_keys = set()
-            
-            for group_name, keys in groups.items():
-                group_has_values = any(k in env_vars for k in keys)
-                if group_has_values:
-                    f.write(f"# {group_name}\n")
-                    for key in keys:
-                        if key in env_vars:
-                            f.write(f"{key}={env_vars[key]}\n")
-                            written_keys.add(key)
-                    f.write("\n")
-            
-            # Write any remaining variables
-            remaining = {k: v for k, v in env_vars.items() if k not in written_keys}
-            if remaining:
-                f.write("# Other Settings\n")
-                for key, value in remaining.items():
-                    f.write(f"{key}={value}\n")
+        lines = [
+            "# IoT2MQTT Configuration\n",
+            f"# Generated at {datetime.now().isoformat()}\n\n"
+        ]
+
+        # Group related variables
+        groups = {
+            "Web Interface": ["WEB_ACCESS_KEY", "WEB_PORT"],
+            "MQTT Broker Settings": ["MQTT_HOST", "MQTT_PORT", "MQTT_USERNAME", "MQTT_PASSWORD"],
+            "MQTT Topics and Client": ["MQTT_BASE_TOPIC", "MQTT_CLIENT_PREFIX", "MQTT_QOS", "MQTT_RETAIN"],
+            "Home Assistant Discovery": ["HA_DISCOVERY_ENABLED", "HA_DISCOVERY_PREFIX"],
+            "Advanced Settings": ["MQTT_KEEPALIVE", "MQTT_CLEAN_SESSION", "MQTT_SHARED_GROUP", "RESPONSE_TIMEOUT", "MAX_RETRIES"]
+        }
+
+        written_keys = set()
+
+        for group_name, keys in groups.items():
+            group_has_values = any(k in env_vars for k in keys)
+            if group_has_values:
+                lines.append(f"# {group_name}\n")
+                for key in keys:
+                    if key in env_vars:
+                        lines.append(f"{key}={env_vars[key]}\n")
+                        written_keys.add(key)
+                lines.append("\n")
+
+        # Write any remaining variables
+        remaining = {k: v for k, v in env_vars.items() if k not in written_keys}
+        if remaining:
+            lines.append("# Other Settings\n")
+            for key, value in remaining.items():
+                lines.append(f"{key}={value}\n")
+
+        with self.locked_file(self.env_file, 'a'):
+            self._replace_file(self.env_file, "".join(lines).encode())
     
     def get_access_key(self) -> Optional[str]:
         """Get web access key from env"""
@@ -178,7 +258,8 @@ class ConfigService:
             "client_prefix": env_vars.get("MQTT_CLIENT_PREFIX", "iot2mqtt"),
             "qos": int(env_vars.get("MQTT_QOS", "1")),
             "retain": env_vars.get("MQTT_RETAIN", "true").lower() == "true",
-            "keepalive": int(env_vars.get("MQTT_KEEPALIVE", "60"))
+            "keepalive": int(env_vars.get("MQTT_KEEPALIVE", "60")),
+            "shared_group": env_vars.get("MQTT_SHARED_GROUP", "")
         }
     
     def save_mqtt_config(self, config: Dict[str, Any]):
@@ -200,68 +281,101 @@ class ConfigService:
         """List available connectors"""
         connectors = []
         
-        if self.connectors_path.exists():
-            for connector_dir in sorted(self.connectors_path.iterdir()):
-                if not connector_dir.is_dir() or connector_dir.name.startswith('_'):
-                    continue
-                
-                # Get connector info
-                info = {
-                    "name": connector_dir.name,
-                    "display_name": connector_dir.name.replace('_', ' ').title(),
-                    "instances": [],
-                    "has_setup": (connector_dir / "setup.json").exists(),
-                    "has_icon": (connector_dir / "icon.svg").exists()
-                }
-                
-                # Count instances
-                instance_dir = self.instances_path / connector_dir.name
-                if instance_dir.exists():
-                    info["instances"] = [f.stem for f in instance_dir.glob("*.json")]
-                
-                # Load setup.json if exists
-                setup_json = connector_dir / "setup.json"
-                if setup_json.exists():
-                    with self.locked_file(setup_json, 'r') as f:
-                        setup_data = json.load(f)
-                        info["display_name"] = setup_data.get("display_name", info["display_name"])
-                        info["description"] = setup_data.get("description", "")
-                        info["version"] = setup_data.get("version", "1.0.0")
-                
-                connectors.append(info)
+        try:
+            with os.scandir(self.connectors_path) as it:
+                connector_dirs = sorted(
+                    (entry for entry in it if entry.is_dir() and not entry.name.startswith('_')),
+                    key=lambda entry: entry.name
+                )
+        except FileNotFoundError:
+            connector_dirs = []
+
+        for connector_dir in connector_dirs:
+            # One directory read answers both "has" checks
+            files = self._list_dir_names(connector_dir.path)
+
+            # Get connector info
+            info = {
+                "name": connector_dir.name,
+                "display_name": connector_dir.name.replace('_', ' ').title(),
+                "instances": [],
+                "has_setup": "setup.json" in files,
+                "has_icon": "icon.svg" in files
+            }
+            
+            # Count instances
+            info["instances"] = [
+                name[:-len(".json")]
+                for name in self._list_dir_names(self.instances_path / connector_dir.name)
+                if name.endswith(".json")
+            ]
+            
+            # Load setup.json if exists
+            setup_data = self.get_connector_setup(connector_dir.name) if info["has_setup"] else None
+            if setup_data is not None:
+                info["display_name"] = setup_data.get("display_name", info["display_name"])
+                info["description"] = setup_data.get("description", "")
+                info["version"] = setup_data.get("version", "1.0.0")
+            
+            connectors.append(info)
         
         return connectors
+
+    @staticmethod
+    def _list_dir_names(path) -> List[str]:
+        """Names of entries in a directory, or [] if it doesn't exist"""
+        try:
+            with os.scandir(path) as it:
+                return [entry.name for entry in it]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
     
     def get_connector_setup(self, connector_name: str) -> Optional[Dict[str, Any]]:
         """Get connector setup schema"""
         setup_file = self.connectors_path / connector_name / "setup.json"
-        
-        if not setup_file.exists():
+
+        try:
+            mtime_ns = setup_file.stat().st_mtime_ns
+        except FileNotFoundError:
             return None
 
-        with self.locked_file(setup_file, 'r') as f:
-            return json.load(f)
+        # Deep copy so callers can't alter the cached schema, nested parts included
+        return copy.deepcopy(_load_setup_cached(str(setup_file), mtime_ns))
     
     def list_instances(self, connector_name: Optional[str] = None) -> List[Dict[str, Any]]:
         """List instances for a connector or all connectors"""
-        instances = []
-        
+        return list(self.iter_instances(connector_name))
+
+    def iter_instances(self, connector_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield instance configs one at a time; see list_instances"""
+        for instance_connector, instance_file in self._iter_instance_files(connector_name):
+            with self.locked_file(Path(instance_file), 'rb') as f:
+                data = orjson.loads(f.read())
+            data["connector_type"] = instance_connector
+            yield data
+
+    def _iter_instance_files(self, connector_name: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+        """
+        Yield (connector_name, path) for every instance config file
+
+        With a connector name only that connector's directory is read.
+        """
         if connector_name:
-            # List instances for specific connector
-            instances_dir = self.instances_path / connector_name
-            if instances_dir.exists():
-                for instance_file in instances_dir.glob("*.json"):
-                    with self.locked_file(instance_file, 'r') as f:
-                        data = json.load(f)
-                        data["connector_type"] = connector_name
-                        instances.append(data)
+            connector_names = [connector_name]
         else:
-            # List all instances
-            for connector_dir in self.connectors_path.iterdir():
-                if connector_dir.is_dir() and not connector_dir.name.startswith('_'):
-                    instances.extend(self.list_instances(connector_dir.name))
-        
-        return instances
+            connector_names = sorted(
+                name for name in self._list_dir_names(self.instances_path)
+                if not name.startswith(('_', '.'))
+            )
+
+        for name in connector_names:
+            try:
+                with os.scandir(self.instances_path / name) as it:
+                    instance_files = [entry.path for entry in it if entry.name.endswith(".json") and entry.is_file()]
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for instance_file in instance_files:
+                yield name, instance_file
     
     def get_instance_config(self, connector_name: str, instance_id: str) -> Optional[Dict[str, Any]]:
         """Get instance configuration"""
@@ -270,8 +384,8 @@ class ConfigService:
         if not instance_file.exists():
             return None
         
-        with self.locked_file(instance_file, 'r') as f:
-            return json.load(f)
+        with self.locked_file(instance_file, 'rb') as f:
+            return orjson.loads(f.read())
     
     def save_instance_config(self, connector_name: str, instance_id: str, config: Dict[str, Any]):
         """Save instance configuration"""
@@ -363,18 +477,14 @@ class ConfigService:
         
         return config
     
-    def get_connector_branding(self, connector_name: str) -> Dict[str, Any]:
-        """Get connector branding information"""
+    def get_connector_branding(self, connector_name: str) -> Mapping[str, Any]:
+        """Get connector branding information; the default one is read-only"""
         setup = self.get_connector_setup(connector_name)
         
         if setup and "branding" in setup:
             return setup["branding"]
         
         # Default branding
-        connector_dir = self.connectors_path / connector_name
-        return {
-            "icon": f"/assets/brands/{connector_name}.svg" if (connector_dir / "icon.svg").exists() else "/assets/default-icon.svg",
-            "color": "#6366F1",  # Default indigo
-            "background": "linear-gradient(135deg, #667eea 0%, #764ba2 100%)",
-            "category": "general"
-        }
+        if (self.connectors_path / connector_name / "icon.svg").exists():
+            return {**_DEFAULT_BRANDING, "icon": f"/assets/brands/{connector_name}.svg"}
+        return _DEFAULT_BRANDING
@@ -3,30 +3,92 @@ MQTT service with WebSocket bridge for real-time updates
 """
 
 import asyncio
+import threading
 import time
-import json
 import logging
-from typing import Dict, Any, List, Optional, Callable, Set
+from typing import Deque, Dict, Any, Iterable, List, Optional, Callable, Set, Tuple
 from datetime import datetime
+import orjson
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import CallbackAPIVersion
-from collections import defaultdict
-import re
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from collections import defaultdict, deque
+from uuid import uuid4
+
+from .topic_index import TopicCache, TopicEntry
 
 logger = logging.getLogger(__name__)
 
+# First bytes that can start a JSON document (incl. leading whitespace);
+# anything else is plain text or binary and is never handed to the parser
+_JSON_START_BYTES = b'{["-0123456789tfn \t\r\n'
+_JSON_CONSTANTS = {b"true": True, b"false": False, b"null": None}
+# Number of clear (empty retained) publishes queued before yielding
+_CLEAR_BATCH_SIZE = 256
+# Messages buffered per handler; a handler that falls further behind loses
+# its oldest messages instead of holding up the others
+_HANDLER_QUEUE_SIZE = 1024
+# MQTT 5 subscription identifiers used in shared-group mode to tell the
+# load-balanced live feed apart from the per-worker retained-state feed
+_SHARED_SUBSCRIPTION_ID = 1
+_STATE_SUBSCRIPTION_ID = 2
+
+
+class _HandlerFeed:
+    """Bounded message queue of one handler and the task that feeds it"""
+
+    __slots__ = ("handler", "queue", "wakeup", "task", "closed")
+
+    def __init__(self, handler: Callable):
+        self.handler = handler
+        self.queue: Deque[Tuple[str, Any, bool]] = deque(maxlen=_HANDLER_QUEUE_SIZE)
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+
 
 class MQTTService:
     """MQTT service with WebSocket integration"""
+
+    # Transient topics that are forwarded to handlers but only cached when retained,
+    # so retained payloads on them can still be found and cleared
+    _NONCACHEABLE_SUFFIXES = ('/cmd', '/cmd/response', '/events', '/telemetry')
     
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.client = None
         self.connected = False
+        self._connected_event = threading.Event()
         self.subscriptions: Dict[str, Set[Callable]] = defaultdict(set)
-        self.topic_cache: Dict[str, Any] = {}  # Cache latest values
+        self.topic_cache = TopicCache()  # Cache latest values
+        # Guards topic_cache and its trie: paho's network thread writes them
+        # while the event loop and executor threads read and clear them
+        self._cache_lock = threading.Lock()
+        self._cache_max = self.config.get('cache_max_topics', 100_000)
+        self._shared_group = self.config.get('shared_group')
+        # (epoch second, ISO string) of the last formatted timestamp
+        self._ts_cache: Tuple[int, str] = (-1, "")
         self.websocket_handlers: Set[Callable] = set()
+        self._feeds: Dict[Callable, _HandlerFeed] = {}
+        # Immutable copy of _feeds values, rebuilt only when handlers change
+        self._feeds_snapshot: Tuple[_HandlerFeed, ...] = ()
+        self._handlers_lock = threading.Lock()
         self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # Messages waiting to be handed to the asyncio loop, drained in batches.
+        # paho's network thread is the only producer and the loop the only
+        # consumer; deque append/popleft are atomic, so no lock is needed.
+        self._pending: Deque[Tuple[str, Any, bool]] = deque()
+        self._drain_scheduled = False
+
+    @property
+    def topic_cache(self) -> TopicCache:
+        """Latest value per topic, indexed by topic prefix"""
+        return self._topic_cache
+
+    @topic_cache.setter
+    def topic_cache(self, value: Dict[str, Any]):
+        self._topic_cache = value if isinstance(value, TopicCache) else TopicCache(value)
 
     def attach_loop(self, loop: asyncio.AbstractEventLoop):
         """Attach asyncio loop used for coroutine dispatch from MQTT thread"""
@@ -37,9 +99,14 @@ class MQTTService:
         try:
             # Create MQTT client with API version 2
             client_id = f"{self.config['client_prefix']}_web"
+            client_kwargs = {}
+            if self._shared_group:
+                # Shared subscriptions ($share/...) require MQTT 5
+                client_kwargs['protocol'] = mqtt.MQTTv5
             self.client = mqtt.Client(
                 callback_api_version=CallbackAPIVersion.VERSION2,
-                client_id=client_id
+                client_id=client_id,
+                **client_kwargs
             )
             self.client.reconnect_delay_set(min_delay=1, max_delay=30)
 
@@ -56,6 +123,7 @@ class MQTTService:
                 )
             
             # Connect
+            self._connected_event.clear()
             self.client.connect(
                 self.config['host'],
                 self.config['port'],
@@ -65,13 +133,8 @@ class MQTTService:
             # Start loop
             self.client.loop_start()
             
-            # Wait for connection
-            timeout = 10
-            while not self.connected and timeout > 0:
-                time.sleep(0.1)
-                timeout -= 0.1
-            
-            return self.connected
+            # Wait for connection (set by _on_connect on CONNACK)
+            return self._connected_event.wait(timeout=10)
             
         except Exception as e:
             logger.error(f"Failed to connect to MQTT: {e}")
@@ -83,23 +146,55 @@ class MQTTService:
             self.client.loop_stop()
             self.client.disconnect()
             self.connected = False
+            self._connected_event.clear()
     
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback for connection (API v2 signature)"""
         if reason_code == 0 or (hasattr(reason_code, 'value') and reason_code.value == 0):
             self.connected = True
+            self._connected_event.set()
             logger.info("Connected to MQTT broker")
 
             # Subscribe only to IoT2mqtt topics (not all topics)
             base_topic = self.config.get('base_topic', 'IoT2mqtt')
-            client.subscribe(f"{base_topic}/#", qos=1)
+            if self._shared_group:
+                # Broker load-balances live messages between all workers of the
+                # group, but never sends retained messages to a shared
+                # subscription. A plain subscription alongside it delivers the
+                # retained state to every worker; its live copies are dropped
+                # in _on_message so the load balancing still holds.
+                client.subscribe(
+                    f"$share/{self._shared_group}/{base_topic}/#", qos=1,
+                    properties=self._subscription_properties(_SHARED_SUBSCRIPTION_ID)
+                )
+                client.subscribe(
+                    f"{base_topic}/#", qos=1,
+                    properties=self._subscription_properties(_STATE_SUBSCRIPTION_ID)
+                )
+            else:
+                client.subscribe(f"{base_topic}/#", qos=1)
 
         else:
             logger.error(f"MQTT connection failed with code {reason_code}")
     
+    @staticmethod
+    def _subscription_properties(subscription_id: int) -> Properties:
+        """SUBSCRIBE properties tagging messages with subscription_id"""
+        properties = Properties(PacketTypes.SUBSCRIBE)
+        properties.SubscriptionIdentifier = subscription_id
+        return properties
+
+    @staticmethod
+    def _is_state_only(msg) -> bool:
+        """Whether msg matched only the retained-state subscription"""
+        subscription_ids = getattr(msg.properties, 'SubscriptionIdentifier', None) or ()
+        return _STATE_SUBSCRIPTION_ID in subscription_ids and \
+            _SHARED_SUBSCRIPTION_ID not in subscription_ids
+
     def _on_disconnect(self, client, userdata, reason_code, properties):
         """Callback for disconnection (API v2 signature)"""
         self.connected = False
+        self._connected_event.clear()
         rc_value = reason_code.value if hasattr(reason_code, 'value') else reason_code
         if rc_value != 0:
             logger.warning(f"Unexpected MQTT disconnection (code {rc_value})")
@@ -109,28 +204,46 @@ class MQTTService:
     def _on_message(self, client, userdata, msg):
         """Callback for incoming messages (API v2 signature is same as v1 for this callback)"""
         try:
+            if self._shared_group and not msg.retain and self._is_state_only(msg):
+                # Live copy from the retained-state subscription; the shared
+                # subscription hands it to exactly one worker
+                return
+
             topic = msg.topic
 
+            buf = msg.payload
+
             # Check if message is empty (topic deletion)
-            if len(msg.payload) == 0:
+            if len(buf) == 0:
                 # Remove from cache
-                self.topic_cache.pop(topic, None)
+                with self._cache_lock:
+                    self.topic_cache.pop(topic, None)
                 self._dispatch_to_handlers(topic, None, msg.retain)
                 return
 
-            # Parse payload
-            try:
-                payload = json.loads(msg.payload.decode())
-            except:
-                payload = msg.payload.decode()
-
-            # Cache the value
-            self.topic_cache[topic] = {
-                "value": payload,
-                "timestamp": datetime.now().isoformat(),
-                "retained": msg.retain,
-                "qos": msg.qos
-            }
+            # Parse payload, skipping the JSON attempt when the first byte rules it out
+            if buf in _JSON_CONSTANTS:
+                payload = _JSON_CONSTANTS[buf]
+            elif buf[:1] not in _JSON_START_BYTES:
+                payload = buf.decode('utf-8', 'replace')
+            else:
+                try:
+                    payload = orjson.loads(buf)
+                except orjson.JSONDecodeError:
+                    payload = buf.decode('utf-8', 'replace')
+
+            if not msg.retain and topic.endswith(self._NONCACHEABLE_SUFFIXES):
+                self._dispatch_to_handlers(topic, payload, msg.retain)
+                return
+
+            # Cache the value, keeping the most recently updated topics
+            entry = TopicEntry(payload, time.time(), msg.retain, msg.qos)
+            with self._cache_lock:
+                cache = self.topic_cache
+                cache[topic] = entry
+                cache.move_to_end(topic)
+                while len(cache) > self._cache_max:
+                    cache.popitem(last=False)
 
             # Notify WebSocket clients
             self._dispatch_to_handlers(topic, payload, msg.retain)
@@ -155,9 +268,9 @@ class MQTTService:
             return False
         
         try:
-            # Convert to JSON if needed
+            # Convert to JSON if needed (orjson returns bytes, which paho sends as-is)
             if isinstance(payload, (dict, list)):
-                payload = json.dumps(payload)
+                payload = orjson.dumps(payload)
             
             # Publish
             result = self.client.publish(topic, payload, qos=qos, retain=retain)
@@ -166,32 +279,63 @@ class MQTTService:
         except Exception as e:
             logger.error(f"Error publishing to {topic}: {e}")
             return False
+
+    def publish_bytes(self, topic: str, payload: bytes, qos: int = 1, retain: bool = False):
+        """Publish an already serialized payload to MQTT"""
+        if not self.connected:
+            logger.warning(f"Not connected, cannot publish to {topic}")
+            return False
+
+        try:
+            result = self.client.publish(topic, payload, qos=qos, retain=retain)
+            return result.rc == mqtt.MQTT_ERR_SUCCESS
+
+        except Exception as e:
+            logger.error(f"Error publishing to {topic}: {e}")
+            return False
     
     def get_topics_list(self) -> List[Dict[str, Any]]:
         """Get flat list of all topics with their values"""
+        with self._cache_lock:
+            items = list(self.topic_cache.items())
+
         topics = []
-        for topic, data in self.topic_cache.items():
+        for topic, data in items:
             topics.append({
                 "topic": topic,
                 "value": data["value"],
-                "timestamp": data["timestamp"],
+                "timestamp": self._format_timestamp(data["timestamp"]),
                 "retained": data.get("retained", False),
                 "qos": data.get("qos", 0)
             })
         return topics
     
+    def _format_timestamp(self, timestamp: Any) -> Any:
+        """Render a cached epoch timestamp as ISO string"""
+        if isinstance(timestamp, float):
+            return self.iso_timestamp(timestamp)
+        return timestamp
+
+    def iso_timestamp(self, timestamp: Optional[float] = None) -> str:
+        """ISO timestamp with second precision, formatted at most once per second"""
+        second = int(time.time() if timestamp is None else timestamp)
+        cached_second, cached_str = self._ts_cache
+        if second != cached_second:
+            cached_str = datetime.fromtimestamp(second).isoformat()
+            self._ts_cache = (second, cached_str)
+        return cached_str
+
     def get_topic_value(self, topic: str) -> Optional[Any]:
         """Get cached value for topic"""
-        if topic in self.topic_cache:
-            return self.topic_cache[topic]
-        return None
+        entry = self.topic_cache.get(topic)
+        if isinstance(entry, TopicEntry):
+            return {**entry.as_dict(), "timestamp": self._format_timestamp(entry.timestamp)}
+        return entry
     
     def send_command(self, instance_id: str, device_id: str, 
                      command: Dict[str, Any]) -> str:
         """Send command to device"""
-        import uuid
-        
-        cmd_id = str(uuid.uuid4())
+        cmd_id = uuid4().hex
         base_topic = self.config.get('base_topic', 'IoT2mqtt')
         
         payload = {
@@ -202,7 +346,7 @@ class MQTTService:
         }
         
         topic = f"{base_topic}/v1/instances/{instance_id}/devices/{device_id}/cmd"
-        self.publish(topic, payload)
+        self.publish_bytes(topic, orjson.dumps(payload))
         
         return cmd_id
     
@@ -211,45 +355,122 @@ class MQTTService:
         base_topic = self.config.get('base_topic', 'IoT2mqtt')
         state_topic = f"{base_topic}/v1/instances/{instance_id}/devices/{device_id}/state"
         
-        if state_topic in self.topic_cache:
-            return self.topic_cache[state_topic].get("value")
-        return None
+        # Single lookup: paho's thread may evict the topic between a check and a read
+        entry = self.topic_cache.get(state_topic)
+        if entry is None:
+            return None
+        return entry.get("value")
     
     def get_instance_devices(self, instance_id: str) -> List[str]:
         """Get list of devices for instance"""
         base_topic = self.config.get('base_topic', 'IoT2mqtt')
-        pattern = f"{base_topic}/v1/instances/{instance_id}/devices/([^/]+)/state"
-        
-        devices = set()
-        for topic in self.topic_cache:
-            match = re.match(pattern, topic)
-            if match:
-                devices.add(match.group(1))
-        
-        return list(devices)
+        devices_base = f"{base_topic}/v1/instances/{instance_id}/devices"
+
+        with self._cache_lock:
+            return self.topic_cache.trie.children_with(devices_base, "state")
     
     def add_websocket_handler(self, handler: Callable):
         """Add WebSocket handler for updates"""
-        self.websocket_handlers.add(handler)
+        with self._handlers_lock:
+            self.websocket_handlers.add(handler)
+            if handler not in self._feeds:
+                self._feeds[handler] = _HandlerFeed(handler)
+                self._feeds_snapshot = tuple(self._feeds.values())
     
     def remove_websocket_handler(self, handler: Callable):
         """Remove WebSocket handler"""
-        self.websocket_handlers.discard(handler)
+        with self._handlers_lock:
+            self.websocket_handlers.discard(handler)
+            feed = self._feeds.pop(handler, None)
+            self._feeds_snapshot = tuple(self._feeds.values())
+
+        if feed is not None:
+            feed.closed = True
+            feed.queue.clear()
+            if feed.task is not None:
+                try:
+                    self.loop.call_soon_threadsafe(feed.task.cancel)
+                except RuntimeError:
+                    pass
 
     def _dispatch_to_handlers(self, topic: str, payload: Any, retained: bool):
         """Dispatch MQTT updates to registered async handlers"""
         if not self.loop:
             return
 
-        for handler in list(self.websocket_handlers):
+        self._pending.append((topic, payload, retained))
+        if self._drain_scheduled:
+            return
+
+        # Wake the loop only when the queue goes from idle to busy
+        self._drain_scheduled = True
+        try:
+            self.loop.call_soon_threadsafe(self._drain_pending)
+        except RuntimeError as exc:
+            self._drain_scheduled = False
+            logger.debug(f"Failed to dispatch MQTT message to handlers: {exc}")
+
+    def _drain_pending(self):
+        """
+        Copy queued MQTT messages into every handler's feed (runs in the asyncio loop).
+        Never waits for a handler; each feed is consumed by its own task.
+        """
+        pending = self._pending
+        batch = [pending.popleft() for _ in range(len(pending))]
+
+        # Clear the flag before the final check so a message appended in
+        # between either is seen here or schedules a new drain
+        self._drain_scheduled = False
+        if pending:
+            self._drain_scheduled = True
+            self.loop.call_soon(self._drain_pending)
+
+        if not batch:
+            return
+
+        for feed in self._feeds_snapshot:
+            if feed.closed:
+                continue
+            overflow = len(feed.queue) + len(batch) - _HANDLER_QUEUE_SIZE
+            if overflow > 0:
+                logger.debug(f"MQTT handler is behind, dropping {overflow} oldest messages")
+            feed.queue.extend(batch)
+            if feed.task is None:
+                feed.task = self.loop.create_task(self._run_feed(feed))
+            feed.wakeup.set()
+
+    @staticmethod
+    async def _run_feed(feed: _HandlerFeed):
+        """Hand a feed's messages to its handler in order until it is removed"""
+        queue = feed.queue
+        while not feed.closed:
+            if not queue:
+                feed.wakeup.clear()
+                await feed.wakeup.wait()
+                continue
+
+            topic, payload, retained = queue.popleft()
             try:
-                asyncio.run_coroutine_threadsafe(handler(topic, payload, retained), self.loop)
+                await feed.handler(topic, payload, retained)
             except Exception as exc:
                 logger.debug(f"Failed to dispatch MQTT message to handler: {exc}")
     
+    def _publish_empty_retained(self, topics: Iterable[str]) -> int:
+        """
+        Publish empty retained messages for topics in batches.
+        Yields the GIL between batches so the network thread can flush them.
+        """
+        count = 0
+        for topic in topics:
+            self.client.publish(topic, "", retain=True, qos=0)
+            count += 1
+            if count % _CLEAR_BATCH_SIZE == 0:
+                time.sleep(0)
+        return count
+
     def clear_instance_topics(self, instance_id: str):
         """
-        Completely clear all MQTT topics for an instance.
+        Clear all MQTT topics for an instance.
         Publishes empty retained messages to remove them from broker.
         """
         if not self.connected:
@@ -260,36 +481,25 @@ class MQTTService:
             base_topic = self.config.get('base_topic', 'IoT2mqtt')
             instance_base = f"{base_topic}/v1/instances/{instance_id}"
             
-            # Find all topics for this instance in cache
-            topics_to_clear = []
-            for topic in self.topic_cache.keys():
-                if topic.startswith(instance_base):
-                    topics_to_clear.append(topic)
-            
-            # Clear each topic by publishing empty retained message
-            for topic in topics_to_clear:
-                self.client.publish(topic, "", retain=True, qos=0)
-                # Remove from cache
-                self.topic_cache.pop(topic, None)
-            
-            # Also clear common subtopics that might not be in cache
-            common_topics = [
+            # Every cached topic under the instance, plus the well-known topics
+            # that may be retained on the broker without being in the cache
+            # (evicted, or published before this backend subscribed); dict
+            # keys keep order and drop topics already listed
+            with self._cache_lock:
+                topics_to_clear = dict.fromkeys(self.topic_cache.iter_prefix(instance_base))
+                devices = self.topic_cache.trie.children(f"{instance_base}/devices")
+            topics_to_clear.update(dict.fromkeys([
                 f"{instance_base}/status",
                 f"{instance_base}/discovered",
                 f"{instance_base}/meta/info",
                 f"{instance_base}/meta/devices_list",
                 f"{instance_base}/groups",
-            ]
-            
-            for topic in common_topics:
-                self.client.publish(topic, "", retain=True, qos=0)
-            
-            # Clear all possible device topics (use wildcard pattern)
-            # We need to clear each device individually since MQTT doesn't support wildcard deletion
-            devices = self.get_instance_devices(instance_id)
+            ]))
+
+            # MQTT has no wildcard deletion, so clear each known device's topics
             for device_id in devices:
                 device_base = f"{instance_base}/devices/{device_id}"
-                device_topics = [
+                topics_to_clear.update(dict.fromkeys([
                     f"{device_base}/state",
                     f"{device_base}/availability",
                     f"{device_base}/cmd",
@@ -297,14 +507,14 @@ class MQTTService:
                     f"{device_base}/events",
                     f"{device_base}/telemetry",
                     f"{device_base}/error"
-                ]
-                for topic in device_topics:
-                    self.client.publish(topic, "", retain=True, qos=0)
-                
-                # Clear individual state properties
-                for topic in self.topic_cache.keys():
-                    if topic.startswith(f"{device_base}/state/"):
-                        self.client.publish(topic, "", retain=True, qos=0)
+                ]))
+
+            self._publish_empty_retained(topics_to_clear)
+
+            # Remove from cache once everything is queued
+            with self._cache_lock:
+                for topic in topics_to_clear:
+                    self.topic_cache.pop(topic, None)
             
             logger.info(f"Cleared all MQTT topics for instance {instance_id}")
             return True
@@ -313,6 +523,11 @@ class MQTTService:
             logger.error(f"Error clearing topics for {instance_id}: {e}")
             return False
     
+    async def clear_instance_topics_async(self, instance_id: str) -> bool:
+        """Run clear_instance_topics in a worker thread to keep the event loop responsive"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.clear_instance_topics, instance_id)
+
     def clear_all_iot2mqtt_topics(self):
         """
         Clear ALL IoT2MQTT topics from the broker.
@@ -324,20 +539,19 @@ class MQTTService:
         
         try:
             base_topic = self.config.get('base_topic', 'IoT2mqtt')
-            base_prefix = f"{base_topic}/"
             
             # Find all IoT2MQTT topics in cache
-            topics_to_clear = []
-            for topic in self.topic_cache.keys():
-                if topic.startswith(base_prefix):
-                    topics_to_clear.append(topic)
+            with self._cache_lock:
+                topics_to_clear = [
+                    topic for topic in self.topic_cache.iter_prefix(base_topic)
+                    if topic != base_topic
+                ]
             
             # Clear each topic
-            cleared_count = 0
-            for topic in topics_to_clear:
-                self.client.publish(topic, "", retain=True, qos=0)
-                self.topic_cache.pop(topic, None)
-                cleared_count += 1
+            cleared_count = self._publish_empty_retained(topics_to_clear)
+            with self._cache_lock:
+                for topic in topics_to_clear:
+                    self.topic_cache.pop(topic, None)
             
             logger.info(f"Cleared {cleared_count} IoT2MQTT topics from broker")
             return True
@@ -345,3 +559,8 @@ class MQTTService:
         except Exception as e:
             logger.error(f"Error clearing all topics: {e}")
             return False
+
+    async def clear_all_iot2mqtt_topics_async(self) -> bool:
+        """Run clear_all_iot2mqtt_topics in a worker thread to keep the event loop responsive"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.clear_all_iot2mqtt_topics)
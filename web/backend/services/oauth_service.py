@@ -2,14 +2,64 @@
 
 from __future__ import annotations
 
-import json
+import contextlib
+import copy
+import fcntl
+import functools
 import os
 import uuid
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+import orjson
 import requests
 
+# Superseded index lines tolerated before the index file is compacted
+_STATE_INDEX_COMPACT_MIN = 1024
+
+
+class _StateIndex:
+    """state → session id map parsed from an append-only JSON lines file."""
+
+    __slots__ = ("inode", "offset", "lines", "sessions")
+
+    def __init__(self, inode: int) -> None:
+        self.inode = inode
+        self.offset = 0
+        self.lines = 0
+        self.sessions: Dict[str, str] = {}
+
+    def feed(self, content: bytes) -> None:
+        """Apply the complete lines of content; a partial last line is read next time."""
+        end = content.rfind(b"\n") + 1
+        for line in content[:end].splitlines():
+            try:
+                entry = orjson.loads(line)
+                state, session_id = entry["state"], entry["session"]
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                continue
+            self.lines += 1
+            if session_id:
+                self.sessions[state] = session_id
+            else:
+                self.sessions.pop(state, None)
+        self.offset += end
+
+
+def _index_line(state: str, session_id: Optional[str]) -> bytes:
+    return orjson.dumps({"state": state, "session": session_id}) + b"\n"
+
+
+# Parsed state index per file path
+_STATE_INDEX_CACHE: Dict[str, _StateIndex] = {}
+
+
+@functools.lru_cache(maxsize=32)
+def _load_provider_cached(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a provider config; the mtime in the key invalidates edited files."""
+    with open(path, "rb") as handle:
+        return orjson.loads(handle.read())
+
 
 class OAuthService:
     """Manage OAuth provider metadata and authorization sessions."""
@@ -19,16 +69,23 @@ class OAuthService:
         self.base_path = Path(raw_base).resolve()
         self.config_path = self.base_path / "config" / "oauth"
         self.sessions_path = self.base_path / "oauth_sessions"
+        # Not *.json files, so they are never mistaken for (or served as) sessions
+        self.state_index_path = self.sessions_path / "state_index.jsonl"
+        self.state_index_lock_path = self.sessions_path / "state_index.lock"
+        # Sessions are short-lived, so fsync only when explicitly requested
+        self.durable_sessions = os.getenv("IOT2MQTT_OAUTH_DURABLE_SESSIONS", "").lower() in ("1", "true", "yes")
         self.config_path.mkdir(parents=True, exist_ok=True)
         self.sessions_path.mkdir(parents=True, exist_ok=True)
 
     def load_provider(self, provider: str) -> Dict[str, Any]:
         """Return provider configuration or raise FileNotFoundError."""
         config_file = self.config_path / f"{provider}.json"
-        if not config_file.exists():
-            raise FileNotFoundError(f"OAuth provider '{provider}' is not configured")
-        with open(config_file, "r", encoding="utf-8") as handle:
-            return json.load(handle)
+        try:
+            mtime_ns = config_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"OAuth provider '{provider}' is not configured") from None
+        # Deep copy so callers can't alter the cached config, nested parts included
+        return copy.deepcopy(_load_provider_cached(str(config_file), mtime_ns))
 
     def create_session(self, provider: str, redirect_uri: Optional[str] = None) -> Dict[str, Any]:
         """Create new OAuth session and return metadata including authorize URL."""
@@ -98,22 +155,113 @@ class OAuthService:
         path = self.sessions_path / f"{session_id}.json"
         if not path.exists():
             return None
-        with open(path, "r", encoding="utf-8") as handle:
-            data = json.load(handle)
+        with open(path, "rb") as handle:
+            data = orjson.loads(handle.read())
         return data
 
     def _find_session_by_state(self, state: str) -> Tuple[str, Optional[Dict[str, Any]]]:
-        for session_file in self.sessions_path.glob("*.json"):
-            with open(session_file, "r", encoding="utf-8") as handle:
-                data = json.load(handle)
-                if data.get("state") == state:
-                    return session_file.stem, data
-        return "", None
+        session_id = self._load_state_index().sessions.get(state)
+        if not session_id:
+            return "", None
+        session = self.get_session(session_id)
+        if session is None or session.get("state") != state:
+            return "", None
+        return session_id, session
+
+    def _load_state_index(self) -> _StateIndex:
+        """Return the state index, reading only lines appended since the last call."""
+        key = str(self.state_index_path)
+        try:
+            stat = self.state_index_path.stat()
+        except FileNotFoundError:
+            self._migrate_state_index()
+            stat = self.state_index_path.stat()
+
+        index = _STATE_INDEX_CACHE.get(key)
+        if index is None or index.inode != stat.st_ino or stat.st_size < index.offset:
+            # New or compacted file: parse it from the start
+            index = _STATE_INDEX_CACHE[key] = _StateIndex(stat.st_ino)
+        if stat.st_size > index.offset:
+            with open(self.state_index_path, "rb") as handle:
+                handle.seek(index.offset)
+                index.feed(handle.read())
+        return index
+
+    @contextlib.contextmanager
+    def _state_index_lock(self) -> Iterator[None]:
+        """Serialize index writers across processes."""
+        with open(self.state_index_lock_path, "a+b") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _migrate_state_index(self) -> None:
+        """Build the index from the session files; only needed once, when it is missing."""
+        with self._state_index_lock():
+            if self.state_index_path.exists():
+                return
+            lines = []
+            for session_file in self.sessions_path.glob("*.json"):
+                try:
+                    with open(session_file, "rb") as handle:
+                        data = orjson.loads(handle.read())
+                except (OSError, orjson.JSONDecodeError):
+                    continue
+                if data.get("state") and data.get("status", "pending") == "pending":
+                    lines.append(_index_line(data["state"], session_file.stem))
+            self._replace_state_index(lines)
+
+    def _replace_state_index(self, lines: List[bytes]) -> None:
+        """Swap in a new index file; caller must hold the index lock."""
+        tmp_path = self.state_index_path.with_name(self.state_index_path.name + ".tmp")
+        with open(tmp_path, "wb") as handle:
+            handle.write(b"".join(lines))
+            if self.durable_sessions:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(tmp_path, self.state_index_path)
+
+    def _update_state_index(self, state: str, session_id: Optional[str]) -> None:
+        """Map state to session_id, or drop the mapping when session_id is None."""
+        with self._state_index_lock():
+            with open(self.state_index_path, "ab") as handle:
+                handle.write(_index_line(state, session_id))
+                if self.durable_sessions:
+                    handle.flush()
+                    os.fsync(handle.fileno())
+
+            # Rewrite the file once most of its lines are superseded
+            index = self._load_state_index()
+            stale = index.lines - len(index.sessions)
+            if stale > max(_STATE_INDEX_COMPACT_MIN, len(index.sessions)):
+                self._replace_state_index([
+                    _index_line(indexed_state, indexed_id)
+                    for indexed_state, indexed_id in index.sessions.items()
+                ])
 
     def _write_session(self, session_id: str, payload: Dict[str, Any]) -> None:
         path = self.sessions_path / f"{session_id}.json"
-        with open(path, "w", encoding="utf-8") as handle:
-            json.dump(payload, handle, indent=2)
+        data = orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+        # Write the whole payload to a temp file and swap it in atomically
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+            if self.durable_sessions:
+                handle.flush()
+                os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+
+        # Only pending sessions can still be completed, so only they stay indexed
+        state = payload.get("state")
+        if state:
+            indexed_id = self._load_state_index().sessions.get(state)
+            if payload.get("status") == "pending":
+                if indexed_id != session_id:
+                    self._update_state_index(state, session_id)
+            elif indexed_id is not None:
+                self._update_state_index(state, None)
 
 
 def get_oauth_service() -> OAuthService:
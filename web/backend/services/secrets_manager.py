@@ -3,89 +3,174 @@ Secrets management service for secure credential storage
 """
 
 import os
-import json
 import base64
+import functools
+import hashlib
+import mmap
+import re
+from collections import deque
 from pathlib import Path
-from typing import Dict, Any, Optional
+import orjson
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Default sensitive field names
+_DEFAULT_SENSITIVE_KEYS = (
+    'password', 'token', 'api_key', 'secret',
+    'private_key', 'credential', 'auth_token'
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _sensitive_key_matcher(sensitive_keys: tuple) -> Callable[[str], bool]:
+    """Build a predicate telling whether a lower-cased key is sensitive
+
+    Keys equal to a sensitive name are answered by a set lookup; anything
+    else falls back to one regex matching any sensitive substring.
+    """
+    lowered = [key.lower() for key in sensitive_keys]
+    exact = frozenset(lowered)
+    # An empty key list must match nothing, not every key
+    search = re.compile("|".join(map(re.escape, lowered)) or "(?!)").search
+
+    def is_sensitive(key_lower: str) -> bool:
+        return key_lower in exact or search(key_lower) is not None
+
+    return is_sensitive
+
+
+# Placeholder left in configs by extract_sensitive_fields; the secret path
+# itself may contain "__"
+_match_secret_placeholder = re.compile(r"^__SECRET__(.+?)__$").match
+
+# Secrets written by this version start with this byte, followed by a
+# 12-byte nonce and the AES-256-GCM ciphertext. Older secrets are Fernet
+# tokens, which always start with b"g" (base64 of the 0x80 version byte).
+_FORMAT_AESGCM = b"\x02"
+_NONCE_SIZE = 12
+
+# Secret files larger than this are memory-mapped instead of read
+_MMAP_THRESHOLD = 4096
+
+
+def _build_ciphers(key: bytes) -> Tuple[AESGCM, Fernet]:
+    """Build the AES-GCM cipher and the legacy Fernet cipher from a master key"""
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=b"iot2mqtt-secrets-aesgcm")
+    aes_key = hkdf.derive(base64.urlsafe_b64decode(key))
+    return AESGCM(aes_key), Fernet(key)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_cipher(path: str, mtime_ns: int) -> Tuple[AESGCM, Fernet]:
+    """Read the master key at path and build ciphers, cached per (path, mtime)"""
+    return _build_ciphers(Path(path).read_bytes())
+
+
+def _write_secret_file(path: Path, data: bytes):
+    """Write data to path, creating it read-only for the owner"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o400)
+    try:
+        # The mode above only applies to new files
+        os.fchmod(fd, 0o400)
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
 class SecretsManager:
     """Manages encryption and storage of sensitive credentials"""
     
     def __init__(self, secrets_path: Optional[str] = None):
         raw_path = secrets_path or os.getenv("IOT2MQTT_SECRETS_PATH") or "/app/secrets"
-        self.secrets_path = Path(raw_path)
-        self.instances_path = self.secrets_path / "instances"
-        self.master_key_path = self.secrets_path / ".master.key"
+        # Plain strings for the construction path; Path views are built on access
+        self._secrets_dir = os.fspath(raw_path)
+        self._instances_dir = os.path.join(self._secrets_dir, "instances")
+        self._master_key_file = os.path.join(self._secrets_dir, ".master.key")
         
         # Create directories if they don't exist
-        self.secrets_path.mkdir(parents=True, exist_ok=True)
-        self.instances_path.mkdir(parents=True, exist_ok=True)
+        if not os.path.isdir(self._instances_dir):
+            os.makedirs(self._instances_dir, exist_ok=True)
         
         # Initialize encryption
-        self.cipher = self._initialize_cipher()
+        self.cipher, self.legacy_cipher = self._initialize_cipher()
+    
+    @functools.cached_property
+    def secrets_path(self) -> Path:
+        return Path(self._secrets_dir)
+    
+    @functools.cached_property
+    def instances_path(self) -> Path:
+        return Path(self._instances_dir)
+    
+    @functools.cached_property
+    def master_key_path(self) -> Path:
+        return Path(self._master_key_file)
     
-    def _initialize_cipher(self) -> Fernet:
+    def _initialize_cipher(self) -> Tuple[AESGCM, Fernet]:
         """Initialize or load the master encryption key"""
-        if self.master_key_path.exists():
-            # Load existing key
-            with open(self.master_key_path, 'rb') as f:
-                key = f.read()
-        else:
+        try:
+            # Load existing key (shared across instances until the file changes)
+            mtime_ns = os.stat(self._master_key_file).st_mtime_ns
+            return _load_cipher(self._master_key_file, mtime_ns)
+        except FileNotFoundError:
             # Generate new key
             key = Fernet.generate_key()
             
             # Save with restricted permissions
-            with open(self.master_key_path, 'wb') as f:
+            with open(self._master_key_file, 'wb') as f:
                 f.write(key)
-            os.chmod(self.master_key_path, 0o400)  # Read-only for owner
+            os.chmod(self._master_key_file, 0o400)  # Read-only for owner
             
             logger.info("Generated new master encryption key")
         
-        return Fernet(key)
+        return _build_ciphers(key)
     
-    def _derive_key_from_password(self, password: str, salt: bytes = None) -> tuple[bytes, bytes]:
-        """Derive encryption key from password using PBKDF2"""
+    def _derive_key_from_password(self, password: str, salt: bytes = None,
+                                  iterations: int = 100_000) -> tuple[bytes, bytes]:
+        """Derive encryption key from password using PBKDF2-HMAC-SHA256"""
         if salt is None:
             salt = os.urandom(16)
         
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=32)
+        key = base64.urlsafe_b64encode(derived)
         return key, salt
     
     def encrypt_credentials(self, credentials: Dict[str, Any]) -> bytes:
         """Encrypt credentials dictionary"""
         try:
-            # Convert to JSON
-            json_str = json.dumps(credentials, separators=(',', ':'))
+            # Convert to compact JSON bytes
+            json_bytes = orjson.dumps(credentials, option=orjson.OPT_NON_STR_KEYS)
             
             # Encrypt
-            encrypted = self.cipher.encrypt(json_str.encode())
+            nonce = os.urandom(_NONCE_SIZE)
+            encrypted = _FORMAT_AESGCM + nonce + self.cipher.encrypt(nonce, json_bytes, None)
             
             return encrypted
         except Exception as e:
             logger.error(f"Failed to encrypt credentials: {e}")
             raise
     
-    def decrypt_credentials(self, encrypted_data: bytes) -> Dict[str, Any]:
+    def decrypt_credentials(self, encrypted_data: Union[bytes, memoryview]) -> Dict[str, Any]:
         """Decrypt credentials"""
         try:
-            # Decrypt
-            decrypted = self.cipher.decrypt(encrypted_data)
+            # Decrypt, accepting Fernet tokens written by older versions
+            if encrypted_data[:1] == _FORMAT_AESGCM:
+                nonce = encrypted_data[1:1 + _NONCE_SIZE]
+                decrypted = self.cipher.decrypt(nonce, encrypted_data[1 + _NONCE_SIZE:], None)
+            else:
+                decrypted = self.legacy_cipher.decrypt(bytes(encrypted_data))
             
             # Parse JSON
-            credentials = json.loads(decrypted.decode())
+            credentials = orjson.loads(decrypted)
             
             return credentials
         except Exception as e:
@@ -98,13 +183,9 @@ class SecretsManager:
             # Encrypt credentials
             encrypted = self.encrypt_credentials(credentials)
             
-            # Save to file
+            # Save to file, read-only for owner from creation on
             secret_path = self.instances_path / f"{instance_id}.secret"
-            with open(secret_path, 'wb') as f:
-                f.write(encrypted)
-            
-            # Set restrictive permissions
-            os.chmod(secret_path, 0o400)
+            _write_secret_file(secret_path, encrypted)
             
             logger.info(f"Saved encrypted credentials for instance: {instance_id}")
             return str(secret_path)
@@ -122,14 +203,16 @@ class SecretsManager:
             return None
         
         try:
-            # Read encrypted data
             with open(secret_path, 'rb') as f:
-                encrypted = f.read()
-            
-            # Decrypt
-            credentials = self.decrypt_credentials(encrypted)
-            
-            return credentials
+                if os.fstat(f.fileno()).st_size > _MMAP_THRESHOLD:
+                    # Decrypt straight from the page cache without copying
+                    # the file into a bytes object first
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                            memoryview(mm) as encrypted:
+                        return self.decrypt_credentials(encrypted)
+                
+                # Small secrets are cheaper to read than to map
+                return self.decrypt_credentials(f.read())
             
         except Exception as e:
             logger.error(f"Failed to load instance secret: {e}")
@@ -155,54 +238,62 @@ class SecretsManager:
         """
         Extract sensitive fields from configuration
         
+        A key is sensitive if its lower-cased name contains any of
+        sensitive_keys; exact names are checked first with a set lookup.
+        
+        Sensitive values are replaced in place, including in nested dicts;
+        pass copy.deepcopy(config) if the original must be kept.
+        
         Returns:
-            (clean_config, sensitive_data)
+            (clean_config, sensitive_data) where clean_config is config itself
         """
         if sensitive_keys is None:
-            # Default sensitive field names
-            sensitive_keys = [
-                'password', 'token', 'api_key', 'secret', 
-                'private_key', 'credential', 'auth_token'
-            ]
+            sensitive_keys = _DEFAULT_SENSITIVE_KEYS
+        is_sensitive = _sensitive_key_matcher(tuple(sensitive_keys))
         
         sensitive_data = {}
-        clean_config = config.copy()
         
-        def extract_recursive(data: dict, path: str = ""):
-            """Recursively extract sensitive fields"""
-            for key, value in list(data.items()):
-                current_path = f"{path}.{key}" if path else key
+        # Walk nested dicts with an explicit stack instead of recursion
+        stack = deque([(config, "")])
+        while stack:
+            data, path = stack.pop()
+            for key, value in data.items():
+                current_path = path + "." + key if path else key
+                key_lower = key.lower()
                 
-                # Check if key is sensitive
-                if any(s in key.lower() for s in sensitive_keys):
+                # Check if key is sensitive (overwriting an existing key is
+                # safe while iterating)
+                if is_sensitive(key_lower):
                     sensitive_data[current_path] = value
-                    data[key] = f"__SECRET__{current_path}__"
+                    data[key] = "__SECRET__" + current_path + "__"
                 
-                # Recurse into nested dicts
-                elif isinstance(value, dict):
-                    extract_recursive(value, current_path)
-        
-        extract_recursive(clean_config)
+                # Descend into nested dicts (configs are plain JSON data, so
+                # an exact type check is enough)
+                elif type(value) is dict:
+                    stack.append((value, current_path))
         
-        return clean_config, sensitive_data
+        return config, sensitive_data
     
     def inject_secrets(self, config: Dict[str, Any], secrets: Dict[str, Any]) -> Dict[str, Any]:
-        """Inject secrets back into configuration"""
-        result = config.copy()
+        """
+        Inject secrets back into configuration
         
-        def inject_recursive(data: dict):
-            """Recursively inject secrets"""
+        Placeholders are replaced in place and config itself is returned;
+        pass copy.deepcopy(config) if the original must be kept.
+        """
+        stack = deque([config])
+        while stack:
+            data = stack.pop()
             for key, value in data.items():
-                if isinstance(value, str) and value.startswith("__SECRET__"):
-                    # Extract secret path
-                    secret_path = value.replace("__SECRET__", "").replace("__", "")
-                    if secret_path in secrets:
-                        data[key] = secrets[secret_path]
-                elif isinstance(value, dict):
-                    inject_recursive(value)
+                if type(value) is str:
+                    # Extract secret path from the placeholder
+                    match = _match_secret_placeholder(value)
+                    if match and match.group(1) in secrets:
+                        data[key] = secrets[match.group(1)]
+                elif type(value) is dict:
+                    stack.append(value)
         
-        inject_recursive(result)
-        return result
+        return config
     
     def create_docker_secret(self, instance_id: str, credentials: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -243,11 +334,14 @@ class SecretsManager:
             
             # Load all existing secrets
             all_secrets = {}
-            for secret_file in self.instances_path.glob("*.secret"):
-                instance_id = secret_file.stem
-                credentials = self.load_instance_secret(instance_id)
-                if credentials:
-                    all_secrets[instance_id] = credentials
+            with os.scandir(self.instances_path) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".secret") or not entry.is_file():
+                        continue
+                    instance_id = entry.name[:-len(".secret")]
+                    credentials = self.load_instance_secret(instance_id)
+                    if credentials:
+                        all_secrets[instance_id] = credentials
             
             # Generate new key
             new_key = Fernet.generate_key()
@@ -256,11 +350,19 @@ class SecretsManager:
             os.chmod(self.master_key_path, 0o400)
             
             # Re-initialize cipher with new key
-            self.cipher = Fernet(new_key)
+            self.cipher, self.legacy_cipher = _build_ciphers(new_key)
+            
+            # Re-encrypt all secrets with new key; AES-GCM releases the GIL
+            # in OpenSSL, so encryption runs concurrently
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+                encrypted = executor.map(self.encrypt_credentials, all_secrets.values())
+                for instance_id, data in zip(all_secrets, encrypted):
+                    _write_secret_file(self.instances_path / f"{instance_id}.secret", data)
             
-            # Re-encrypt all secrets with new key
-            for instance_id, credentials in all_secrets.items():
-                self.save_instance_secret(instance_id, credentials)
+            # Drop ciphers built from the old key, and shared managers that
+            # may still hold one
+            _load_cipher.cache_clear()
+            _get_secrets_manager.cache_clear()
             
             logger.info("Successfully rotated master encryption key")
             return True
@@ -268,3 +370,13 @@ class SecretsManager:
         except Exception as e:
             logger.error(f"Failed to rotate master key: {e}")
             return False
+
+
+@functools.lru_cache(maxsize=None)
+def _get_secrets_manager(secrets_path: str) -> SecretsManager:
+    return SecretsManager(secrets_path)
+
+
+def get_secrets_manager(secrets_path: Optional[str] = None) -> SecretsManager:
+    """Get the SecretsManager shared by everything using secrets_path"""
+    return _get_secrets_manager(secrets_path or os.getenv("IOT2MQTT_SECRETS_PATH") or "/app/secrets")
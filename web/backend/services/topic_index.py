@@ -0,0 +1,173 @@
+"""
+Prefix index for MQTT topics cached by the web backend
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+# Marker key stored on a trie node when a topic ends at that node.
+# Topic segments are always strings, so None never collides with one.
+_LEAF = None
+
+
+class TopicTrie:
+    """Trie of '/'-separated topic segments for fast prefix queries"""
+
+    def __init__(self):
+        self._root: Dict[Any, Any] = {}
+
+    def insert(self, topic: str):
+        """Add topic to the index"""
+        node = self._root
+        for part in topic.split('/'):
+            child = node.get(part)
+            if child is None:
+                child = node[part] = {}
+            node = child
+        node[_LEAF] = topic
+
+    def remove(self, topic: str):
+        """Remove topic from the index, pruning empty branches"""
+        path = []
+        node = self._root
+        for part in topic.split('/'):
+            child = node.get(part)
+            if child is None:
+                return
+            path.append((node, part))
+            node = child
+
+        if _LEAF not in node:
+            return
+        del node[_LEAF]
+
+        # Drop nodes that no longer lead to any topic
+        for parent, part in reversed(path):
+            if parent[part]:
+                break
+            del parent[part]
+
+    def clear(self):
+        """Remove all topics"""
+        self._root.clear()
+
+    def _find(self, prefix: str) -> Optional[Dict[Any, Any]]:
+        node = self._root
+        for part in prefix.split('/'):
+            node = node.get(part)
+            if node is None:
+                return None
+        return node
+
+    def iter_prefix(self, prefix: str) -> Iterator[str]:
+        """Yield prefix itself (if it is a topic) and every topic below it"""
+        node = self._find(prefix)
+        if node is None:
+            return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is _LEAF:
+                    yield child
+                else:
+                    stack.append(child)
+
+    def children(self, prefix: str) -> List[str]:
+        """Get the next topic segments directly below prefix"""
+        node = self._find(prefix)
+        if node is None:
+            return []
+        return [key for key in node if key is not _LEAF]
+
+    def children_with(self, prefix: str, suffix: str) -> List[str]:
+        """Get child segments of prefix for which '<prefix>/<child>/<suffix>' is a topic"""
+        node = self._find(prefix)
+        if node is None:
+            return []
+
+        parts = suffix.split('/')
+        matches = []
+        for key, child in node.items():
+            if key is _LEAF:
+                continue
+            for part in parts:
+                child = child.get(part)
+                if child is None:
+                    break
+            else:
+                if _LEAF in child:
+                    matches.append(key)
+        return matches
+
+
+class TopicEntry:
+    """Cached MQTT message with read-only dict-style access to its fields"""
+
+    __slots__ = ("value", "timestamp", "retained", "qos")
+
+    def __init__(self, value: Any, timestamp: Any, retained: bool, qos: int):
+        self.value = value
+        self.timestamp = timestamp
+        self.retained = retained
+        self.qos = qos
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.__slots__:
+            return getattr(self, key)
+        return default
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return fields as a plain dict"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TopicCache(OrderedDict):
+    """Topic → cached value mapping (oldest first) that keeps a TopicTrie in sync"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.trie = TopicTrie()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, topic: str, value: Any):
+        if topic not in self:
+            self.trie.insert(topic)
+        super().__setitem__(topic, value)
+
+    def __delitem__(self, topic: str):
+        super().__delitem__(topic)
+        self.trie.remove(topic)
+
+    def pop(self, topic: str, *default):
+        if topic in self:
+            self.trie.remove(topic)
+        return super().pop(topic, *default)
+
+    def popitem(self, last: bool = True):
+        topic, value = super().popitem(last=last)
+        self.trie.remove(topic)
+        return topic, value
+
+    def setdefault(self, topic: str, default: Any = None):
+        if topic not in self:
+            self[topic] = default
+        return self[topic]
+
+    def update(self, *args, **kwargs):
+        for topic, value in dict(*args, **kwargs).items():
+            self[topic] = value
+
+    def clear(self):
+        super().clear()
+        self.trie.clear()
+
+    def iter_prefix(self, prefix: str) -> Iterator[str]:
+        """Yield cached topics equal to or below prefix"""
+        return self.trie.iter_prefix(prefix)
@@ -1,12 +1,33 @@
 from __future__ import annotations
 
 import os
-import tempfile
 from pathlib import Path
 from unittest.mock import Mock
 
 import pytest
 from cryptography.fernet import Fernet
+from pytest_asyncio import is_async_test
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "mutates_discovered: test changes the shared discovered devices file, which is restored afterwards"
+    )
+
+
+def pytest_collection_modifyitems(items):
+    """Run every async test on the session event loop instead of a fresh one per test"""
+    session_loop = pytest.mark.asyncio(loop_scope="session")
+    for item in items:
+        if is_async_test(item):
+            item.add_marker(session_loop, append=False)
+
+
+@pytest.fixture(autouse=True)
+def _no_net(socket_disabled):
+    """Fail fast on any real network call; unix sockets stay allowed for event loops"""
+    pass
 
 
 @pytest.fixture(autouse=True)
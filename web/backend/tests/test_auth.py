@@ -6,7 +6,7 @@ import pytest
 from unittest.mock import Mock, patch
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException
-from jose import jwt
+import jwt
 
 from api.auth import (
     create_access_token,
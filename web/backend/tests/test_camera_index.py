@@ -0,0 +1,92 @@
+"""
+Tests for the camera database search index
+"""
+
+import pytest
+
+from services.camera_index_service import CameraIndexService
+from cameras.camera_index import CameraIndex, CameraModel
+
+
+def _make_index(rows):
+    index = CameraIndex()
+    for brand, model in rows:
+        index.models.append(CameraModel(
+            brand=brand,
+            brand_id=brand.lower(),
+            model=model,
+            display=f"{brand}: {model}",
+            entry={"models": [model]}
+        ))
+    index._loaded = True
+    return index
+
+
+def _linear_search(index, query, limit=50):
+    """Reference search scanning every model"""
+    query_lower = query.lower().strip()
+    displays = []
+    for camera_model in index.models:
+        if query_lower in camera_model.brand.lower() or query_lower in camera_model.model.lower():
+            if camera_model.display not in displays:
+                displays.append(camera_model.display)
+            if len(displays) >= limit:
+                break
+    return displays
+
+
+@pytest.fixture(scope="session")
+def camera_service():
+    """Camera service backed by the real database, loaded once per session"""
+    return CameraIndexService()
+
+
+class TestCameraIndexSearch:
+    """Test CameraIndex.search with the trigram candidate index"""
+
+    ROWS = [
+        ("Hikvision", "DS-2CD2032-I"),
+        ("Hikvision", "DS-2CD2142FWD"),
+        ("Dahua", "IPC-HDW4431C"),
+        ("Axis", "M1065-L"),
+        ("Foscam", "FI9821P"),
+        ("Hikvision", "DS-2CD2032-I"),  # duplicate display
+        ("IPC Vision", "A1"),
+    ]
+
+    @pytest.mark.parametrize("query", ["hik", "2cd", "DS-2CD2032", "ipc", "m1065", "I", "zzz", "sion"])
+    def test_search_matches_linear_scan(self, query):
+        """Indexed search returns the same models, in order, as a full scan"""
+        index = _make_index(self.ROWS)
+
+        results = [r["display"] for r in index.search(query) if r["entry"] is not None]
+
+        assert results == _linear_search(index, query)
+
+    def test_search_respects_limit(self):
+        """Limit applies to model matches, not the prepended Unlisted options"""
+        index = _make_index(self.ROWS)
+
+        results = index.search("ds-2", limit=1)
+
+        assert [r["display"] for r in results] == ["Hikvision: Unlisted", "Hikvision: DS-2CD2032-I"]
+
+    def test_search_query_spanning_brand_and_model_does_not_match(self):
+        """Queries must match within brand or model, not across the display string"""
+        index = _make_index(self.ROWS)
+
+        assert index.search("Axis: M1065") == []
+
+    def test_search_very_long_query(self):
+        """Long queries are rejected by the trigram index without scanning"""
+        index = _make_index(self.ROWS)
+
+        assert index.search("x" * 1000) == []
+
+    def test_real_database_search(self, camera_service):
+        """Searching the bundled database agrees with a full scan"""
+        index = camera_service.index
+
+        for query in ("hikvision", "2cd2032", "brand: model-123_456"):
+            results = [r["display"] for r in camera_service.search(query, 20) if r["entry"] is not None]
+            assert results == _linear_search(index, query, 20)
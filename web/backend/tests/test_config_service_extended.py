@@ -2,6 +2,8 @@
 Extended tests for ConfigService
 """
 
+import errno
+import fcntl
 import json
 import os
 import yaml
@@ -10,7 +12,7 @@ from unittest.mock import patch, Mock
 
 import pytest
 
-from services.config_service import ConfigService
+from services.config_service import ConfigService, _detect_base_path_cached
 
 
 class TestConfigServiceExtended:
@@ -45,6 +47,17 @@ class TestConfigServiceExtended:
         # Should find the root path with docker-compose.yml
         assert str(service.base_path).endswith(str(tmp_path.name))
 
+    def test_detect_base_path_is_cached(self, setup_test_env):
+        """Test the docker-compose.yml walk runs once per process"""
+        service = ConfigService(base_path=str(setup_test_env))
+        _detect_base_path_cached.cache_clear()
+
+        first = service._detect_base_path()
+        second = ConfigService(base_path=str(setup_test_env))._detect_base_path()
+
+        assert first == second
+        assert _detect_base_path_cached.cache_info().hits == 1
+
     def test_save_and_load_env_vars(self, setup_test_env):
         """Test saving and loading environment variables"""
         service = ConfigService(base_path=str(setup_test_env))
@@ -177,6 +190,22 @@ class TestConfigServiceExtended:
         assert len(connectors) == 1
         assert connectors[0]["name"] == "real_connector"
 
+    def test_list_connectors_includes_instances(self, setup_test_env):
+        """Test connector listing reports its instances and file flags"""
+        service = ConfigService(base_path=str(setup_test_env))
+
+        (setup_test_env / "connectors" / "lights").mkdir(parents=True)
+        service.save_instance_config("lights", "kitchen", {})
+        service.save_instance_config("lights", "hall", {})
+
+        connectors = service.list_connectors()
+
+        assert len(connectors) == 1
+        assert sorted(connectors[0]["instances"]) == ["hall", "kitchen"]
+        assert connectors[0]["has_setup"] is False
+        assert connectors[0]["has_icon"] is False
+        assert "description" not in connectors[0]
+
     def test_instance_with_devices(self, setup_test_env):
         """Test instance management with devices list"""
         service = ConfigService(base_path=str(setup_test_env))
@@ -221,6 +250,20 @@ class TestConfigServiceExtended:
         assert len(connector1_instances) == 2
         assert all(i["connector_type"] == "connector1" for i in connector1_instances)
 
+    def test_iter_instances_reads_only_requested_connector(self, setup_test_env):
+        """Test iter_instances is lazy and skips other connectors' files"""
+        service = ConfigService(base_path=str(setup_test_env))
+
+        service.save_instance_config("connector1", "inst1", {})
+        # Would fail to parse if it were read
+        (setup_test_env / "instances" / "connector2").mkdir()
+        (setup_test_env / "instances" / "connector2" / "broken.json").write_text("{")
+
+        instances = service.iter_instances("connector1")
+
+        assert not isinstance(instances, list)
+        assert [i["instance_id"] for i in instances] == ["inst1"]
+
     def test_delete_instance_creates_backup(self, setup_test_env):
         """Test that deleting instance creates backup"""
         service = ConfigService(base_path=str(setup_test_env))
@@ -309,6 +352,31 @@ class TestConfigServiceExtended:
         schema = service.get_connector_setup("nonexistent")
         assert schema is None
 
+    def test_connector_setup_reloads_after_edit(self, setup_test_env):
+        """Test cached setup schema is re-read when setup.json changes"""
+        service = ConfigService(base_path=str(setup_test_env))
+
+        connector_dir = setup_test_env / "connectors" / "test_connector"
+        connector_dir.mkdir(parents=True)
+        setup_file = connector_dir / "setup.json"
+        setup_file.write_text(json.dumps({"display_name": "Old Name", "branding": {"category": "light"}}))
+
+        assert service.get_connector_setup("test_connector")["display_name"] == "Old Name"
+
+        # Callers get a copy, not the cached schema
+        service.get_connector_setup("test_connector")["display_name"] = "Mutated"
+        service.get_connector_branding("test_connector")["category"] = "mutated"
+        assert service.get_connector_setup("test_connector")["display_name"] == "Old Name"
+        assert service.get_connector_branding("test_connector") == {"category": "light"}
+
+        setup_file.write_text(json.dumps({"display_name": "New Name"}))
+        stat = setup_file.stat()
+        os.utime(setup_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert service.get_connector_setup("test_connector")["display_name"] == "New Name"
+        connectors = service.list_connectors()
+        assert connectors[0]["display_name"] == "New Name"
+
     def test_connector_branding(self, setup_test_env):
         """Test connector branding information"""
         service = ConfigService(base_path=str(setup_test_env))
@@ -345,6 +413,21 @@ class TestConfigServiceExtended:
         assert branding["category"] == "general"
         assert "default-icon.svg" in branding["icon"]
 
+    def test_connector_branding_defaults_with_icon(self, setup_test_env):
+        """Test default branding points at the connector icon when it has one"""
+        service = ConfigService(base_path=str(setup_test_env))
+
+        connector_dir = setup_test_env / "connectors" / "test_connector"
+        connector_dir.mkdir(parents=True)
+        (connector_dir / "icon.svg").write_text("<svg>test</svg>")
+
+        branding = service.get_connector_branding("test_connector")
+
+        assert branding["icon"] == "/assets/brands/test_connector.svg"
+        assert branding["color"] == "#6366F1"
+        # The shared default is left untouched
+        assert "default-icon.svg" in service.get_connector_branding("nonexistent_connector")["icon"]
+
     def test_save_instance_with_secrets_separation(self, setup_test_env):
         """Test saving instance with secrets separation"""
         service = ConfigService(base_path=str(setup_test_env))
@@ -387,6 +470,24 @@ class TestConfigServiceExtended:
         assert test_file.exists()
         assert test_file.read_text() == "test content"
 
+    def test_file_locking_shares_reads(self, setup_test_env):
+        """Test readers share the lock while writers exclude them"""
+        service = ConfigService(base_path=str(setup_test_env))
+
+        test_file = setup_test_env / "test_lock.txt"
+        test_file.write_text("test content")
+
+        with service.locked_file(test_file, 'r'):
+            # A second reader gets the lock straight away
+            with open(test_file) as other:
+                fcntl.flock(other, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                fcntl.flock(other, fcntl.LOCK_UN)
+
+        with service.locked_file(test_file, 'r+'):
+            with open(test_file) as other:
+                with pytest.raises(BlockingIOError):
+                    fcntl.flock(other, fcntl.LOCK_SH | fcntl.LOCK_NB)
+
     def test_locked_json_file_context(self, setup_test_env):
         """Test locked JSON file context manager"""
         service = ConfigService(base_path=str(setup_test_env))
@@ -408,4 +509,46 @@ class TestConfigServiceExtended:
 
         # Verify modification persisted
         loaded_data = json.loads(test_file.read_text())
-        assert loaded_data["new_key"] == "new_value"
\ No newline at end of file
+        assert loaded_data["new_key"] == "new_value"
+
+    def test_locked_json_file_replaces_atomically(self, setup_test_env):
+        """Test JSON writes swap in a new file instead of truncating in place"""
+        service = ConfigService(base_path=str(setup_test_env))
+
+        test_file = setup_test_env / "test.json"
+        with service.locked_json_file(test_file) as container:
+            container['data'] = {"version": 1}
+        old_inode = test_file.stat().st_ino
+
+        with service.locked_json_file(test_file) as container:
+            container['data']["version"] = 2
+
+        assert test_file.stat().st_ino != old_inode
+        assert json.loads(test_file.read_text()) == {"version": 2}
+        assert not (setup_test_env / "test.json.tmp").exists()
+
+    def test_locked_json_file_syncs_directory_after_replace(self, setup_test_env):
+        """Test the parent directory is fsynced as part of each replace"""
+        service = ConfigService(base_path=str(setup_test_env))
+        test_file = setup_test_env / "test.json"
+
+        with patch("services.config_service.os.fsync") as mock_fsync, \
+                patch("services.config_service.os.open", wraps=os.open) as mock_open:
+            with service.locked_json_file(test_file) as container:
+                container['data'] = {"version": 1}
+
+        mock_open.assert_any_call(setup_test_env, os.O_RDONLY)
+        # Once for the temp file, once for the directory
+        assert mock_fsync.call_count == 2
+
+    def test_save_env_falls_back_when_file_is_bind_mounted(self, setup_test_env):
+        """Test .env is rewritten in place when it can't be renamed over"""
+        service = ConfigService(base_path=str(setup_test_env))
+        service.save_env({"MQTT_HOST": "old"})
+
+        busy = OSError(errno.EBUSY, "Device or resource busy")
+        with patch("services.config_service.os.replace", side_effect=busy):
+            service.save_env({"MQTT_HOST": "new"})
+
+        assert service.load_env()["MQTT_HOST"] == "new"
+        assert not (setup_test_env / ".env.tmp").exists()
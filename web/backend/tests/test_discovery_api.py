@@ -4,324 +4,351 @@ Tests for Discovery API endpoints
 """
 
 import pytest
+import pytest_asyncio
 import json
-import tempfile
 from pathlib import Path
-from unittest.mock import Mock, patch, MagicMock, AsyncMock
+from types import SimpleNamespace
+from unittest.mock import Mock, AsyncMock
 from datetime import datetime
-from fastapi.testclient import TestClient
-from fastapi import FastAPI
 
-# Import the router lazily in tests to avoid module-level initialization
+
+# Connector manifests read by the endpoints under test, encoded once
+_SCAN_MANIFEST_JSON = json.dumps({
+    "discovery": {
+        "supported": True,
+        "timeout": 10
+    }
+})
+_UNSUPPORTED_MANIFEST_JSON = json.dumps({
+    "discovery": {
+        "supported": False
+    }
+})
+
+# Initial content of the discovered devices file, with fixed timestamps
+_FIXED_ISO = "2024-01-01T00:00:00"
+_DISCOVERED_BYTES = json.dumps({
+    "last_scan": _FIXED_ISO,
+    "devices": [
+        {
+            "id": "yeelight_192_168_1_100",
+            "name": "Test Light",
+            "integration": "yeelight",
+            "ip": "192.168.1.100",
+            "port": 55443,
+            "model": "color",
+            "discovered_at": _FIXED_ISO,
+            "added": False
+        },
+        {
+            "id": "yeelight_192_168_1_101",
+            "name": "Added Light",
+            "integration": "yeelight",
+            "ip": "192.168.1.101",
+            "discovered_at": _FIXED_ISO,
+            "added": True
+        }
+    ]
+}).encode()
+
+
+@pytest.fixture(scope="module")
+def discovery(tmp_path_factory):
+    """
+    The api.discovery module, imported on first use
+
+    Imported here rather than at the top of the file so collecting (or
+    deselecting) these tests doesn't load FastAPI and the backend.
+    """
+    base_path = tmp_path_factory.mktemp("discovery")
+    with pytest.MonkeyPatch.context() as mp:
+        # api.discovery builds its services at import time, so point them at
+        # a scratch directory rather than the repository
+        mp.setenv("IOT2MQTT_PATH", str(base_path))
+        mp.setenv("IOT2MQTT_SECRETS_PATH", str(base_path / "secrets"))
+        import api.discovery
+
+    return api.discovery
+
+
+@pytest.fixture(scope="module")
+def app(discovery):
+    """App serving the discovery router, shared by every test in this module"""
+    from fastapi import FastAPI
+
+    app = FastAPI()
+    app.include_router(discovery.router)
+    return app
+
+
+@pytest.fixture(scope="module")
+def client(app):
+    """Test client for the WebSocket endpoint, which httpx cannot drive"""
+    from fastapi.testclient import TestClient
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest_asyncio.fixture
+async def async_client(app):
+    """Client calling the app in-process over ASGI for the JSON endpoints"""
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
+
+
+@pytest.fixture(scope="module")
+def mock_discovered_file(tmp_path_factory):
+    """
+    Discovered devices file shared by the tests in this module
+
+    data is the file's initial content, parsed once; reload() parses what
+    is on disk now.
+    """
+    path = tmp_path_factory.mktemp("discovered") / "discovered_devices.json"
+    path.write_bytes(_DISCOVERED_BYTES)
+    return SimpleNamespace(
+        path=path,
+        data=json.loads(_DISCOVERED_BYTES),
+        reload=lambda: json.loads(path.read_text())
+    )
+
+
+@pytest.fixture(autouse=True)
+def restore_discovered_file(request):
+    """Rewrite the shared discovered devices file after tests that change it"""
+    if request.node.get_closest_marker("mutates_discovered") is None:
+        yield
+        return
+
+    discovered_file = request.getfixturevalue("mock_discovered_file")
+    yield
+    discovered_file.path.write_bytes(_DISCOVERED_BYTES)
+
+
+@pytest.fixture
+def discovery_mocks(app, discovery, monkeypatch, setup_test_env, mock_discovered_file):
+    """
+    Replace the services and HTTP calls used by api.discovery
+
+    Routes get the shared discovered devices file through a dependency
+    override (cleared by monkeypatch), connector manifests are read from
+    setup_test_env/connectors, and the test-runner answers 503 unless a
+    test says otherwise.
+    """
+    config = Mock()
+    config.discovered_devices_path = mock_discovered_file.path
+    config.connectors_path = setup_test_env / "connectors"
+    docker = Mock()
+    post = Mock(return_value=Mock(status_code=503, text="unavailable"))
+    get = Mock(return_value=Mock(status_code=503, text="unavailable"))
+    sleep = AsyncMock()
+
+    monkeypatch.setitem(app.dependency_overrides, discovery.get_discovered_path, lambda: mock_discovered_file.path)
+    monkeypatch.setattr(discovery, "config_service", config)
+    monkeypatch.setattr(discovery, "docker_service", docker)
+    monkeypatch.setattr(discovery.requests, "post", post)
+    monkeypatch.setattr(discovery.requests, "get", get)
+    # Only the module's view of asyncio, so the event loop keeps the real sleep
+    monkeypatch.setattr(discovery, "asyncio", SimpleNamespace(sleep=sleep))
+
+    return SimpleNamespace(config=config, docker=docker, post=post, get=get, sleep=sleep)
+
+
+def _write_manifest(connectors_path: Path, integration: str, manifest_json: str):
+    connector_dir = connectors_path / integration
+    connector_dir.mkdir(parents=True, exist_ok=True)
+    (connector_dir / "manifest.json").write_text(manifest_json)
 
 
 class TestDiscoveryAPI:
     """Test Discovery API endpoints"""
     
-    @pytest.fixture
-    def mock_discovered_file(self):
-        """Create a temporary discovered devices file"""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as f:
-            data = {
-                "last_scan": datetime.now().isoformat(),
-                "devices": [
-                    {
-                        "id": "yeelight_192_168_1_100",
-                        "name": "Test Light",
-                        "integration": "yeelight",
-                        "ip": "192.168.1.100",
-                        "port": 55443,
-                        "model": "color",
-                        "discovered_at": datetime.now().isoformat(),
-                        "added": False
-                    },
-                    {
-                        "id": "yeelight_192_168_1_101",
-                        "name": "Added Light",
-                        "integration": "yeelight",
-                        "ip": "192.168.1.101",
-                        "discovered_at": datetime.now().isoformat(),
-                        "added": True
-                    }
-                ]
-            }
-            json.dump(data, f)
-            return Path(f.name)
-    
-    def test_get_discovered_devices(self, mock_discovered_file):
+    async def test_get_discovered_devices(self, async_client, discovery_mocks):
         """Test getting discovered devices"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value = mock_discovered_file
-            mock_path.return_value.exists.return_value = True
-            
-            response = client.get("/api/discovery/devices")
-            
-            assert response.status_code == 200
-            devices = response.json()
-            assert len(devices) == 2
-            assert devices[0]["id"] == "yeelight_192_168_1_100"
-            assert devices[0]["added"] is False
+        response = await async_client.get("/api/discovery/devices")
+        
+        assert response.status_code == 200
+        devices = response.json()
+        assert len(devices) == 2
+        assert devices[0]["id"] == "yeelight_192_168_1_100"
+        assert devices[0]["added"] is False
     
-    def test_get_discovered_devices_empty(self):
+    async def test_get_discovered_devices_empty(self, app, discovery, async_client, discovery_mocks, tmp_path):
         """Test getting devices when file doesn't exist"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value.exists.return_value = False
-            
-            response = client.get("/api/discovery/devices")
-            
-            assert response.status_code == 200
-            assert response.json() == []
+        app.dependency_overrides[discovery.get_discovered_path] = lambda: tmp_path / "missing.json"
+        
+        response = await async_client.get("/api/discovery/devices")
+        
+        assert response.status_code == 200
+        assert response.json() == []
     
-    def test_add_discovered_device(self, mock_discovered_file):
+    @pytest.mark.mutates_discovered
+    async def test_add_discovered_device(self, async_client, discovery_mocks):
         """Test adding a discovered device"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value = mock_discovered_file
-            mock_path.return_value.exists.return_value = True
-            
-            # Mock config service
-            with patch('api.discovery.config_service') as mock_config:
-                mock_config.connectors_path = Path("/test/connectors")
-                
-                # Mock docker service
-                with patch('api.discovery.docker_service') as mock_docker:
-                    mock_docker.create_or_update_container = Mock()
-                    
-                    request_data = {
-                        "device_id": "yeelight_192_168_1_100",
-                        "instance_id": "living_room",
-                        "friendly_name": "Living Room Light"
-                    }
-                    
-                    response = client.post(
-                        "/api/discovery/devices/yeelight_192_168_1_100/add",
-                        json=request_data
-                    )
-                    
-                    assert response.status_code == 200
-                    result = response.json()
-                    assert result["status"] == "success"
-                    assert result["instance_id"] == "living_room"
-                    
-                    # Verify Docker was called
-                    mock_docker.create_or_update_container.assert_called_once()
+        (discovery_mocks.config.connectors_path / "yeelight").mkdir()
+        
+        request_data = {
+            "device_id": "yeelight_192_168_1_100",
+            "instance_id": "living_room",
+            "friendly_name": "Living Room Light"
+        }
+        
+        response = await async_client.post(
+            "/api/discovery/devices/yeelight_192_168_1_100/add",
+            json=request_data
+        )
+        
+        assert response.status_code == 200
+        result = response.json()
+        assert result["status"] == "success"
+        assert result["instance_id"] == "living_room"
+        
+        # Verify Docker was called
+        discovery_mocks.docker.create_or_update_container.assert_called_once()
     
-    def test_add_device_not_found(self, mock_discovered_file):
+    async def test_add_device_not_found(self, async_client, discovery_mocks):
         """Test adding a device that doesn't exist"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value = mock_discovered_file
-            mock_path.return_value.exists.return_value = True
-            
-            request_data = {
-                "device_id": "nonexistent",
-                "instance_id": "test",
-                "friendly_name": "Test"
-            }
-            
-            response = client.post(
-                "/api/discovery/devices/nonexistent/add",
-                json=request_data
-            )
-            
-            assert response.status_code == 404
-            assert "not found" in response.json()["detail"]
+        request_data = {
+            "device_id": "nonexistent",
+            "instance_id": "test",
+            "friendly_name": "Test"
+        }
+        
+        response = await async_client.post(
+            "/api/discovery/devices/nonexistent/add",
+            json=request_data
+        )
+        
+        assert response.status_code == 404
+        assert "not found" in response.json()["detail"]
     
-    def test_add_device_manually(self):
+    async def test_add_device_manually(self, async_client, discovery_mocks):
         """Test manually adding a device"""
-        with patch('api.discovery.config_service') as mock_config:
-            mock_config.connectors_path = Path("/test/connectors")
-            
-            # Mock manifest file
-            manifest = {
-                "manual_config": {
-                    "fields": [
-                        {"name": "port", "default": 55443}
-                    ],
-                    "test_connection": {
-                        "enabled": False
-                    }
-                }
-            }
-            
-            with patch('builtins.open', create=True) as mock_open:
-                mock_open.return_value.__enter__.return_value.read.return_value = json.dumps(manifest)
-                
-                with patch('api.discovery.Path') as mock_path:
-                    mock_path.return_value.exists.return_value = True
-                    
-                    with patch('api.discovery.docker_service') as mock_docker:
-                        mock_docker.create_or_update_container = Mock()
-                        
-                        request_data = {
-                            "integration": "yeelight",
-                            "instance_id": "manual_device",
-                            "friendly_name": "Manual Device",
-                            "ip": "192.168.1.200",
-                            "port": 55443,
-                            "name": "Test Device"
-                        }
-                        
-                        response = client.post("/api/discovery/manual", json=request_data)
-                        
-                        assert response.status_code == 200
-                        result = response.json()
-                        assert result["status"] == "success"
-                        assert result["instance_id"] == "manual_device"
+        discovery_mocks.post.return_value = Mock(status_code=200, json=Mock(return_value={"success": True}))
+        
+        request_data = {
+            "integration": "yeelight",
+            "instance_id": "manual_device",
+            "friendly_name": "Manual Device",
+            "ip": "192.168.1.200",
+            "port": 55443,
+            "name": "Test Device"
+        }
+        
+        response = await async_client.post("/api/discovery/manual", json=request_data)
+        
+        assert response.status_code == 200
+        result = response.json()
+        assert result["status"] == "success"
+        assert result["instance_id"] == "manual_device"
+        discovery_mocks.config.save_instance_with_secrets.assert_called_once()
+        discovery_mocks.docker.create_or_update_container.assert_called_once()
     
-    def test_scan_single_integration(self):
+    async def test_scan_single_integration(self, async_client, discovery_mocks):
         """Test triggering a scan for single integration"""
-        manifest = {
-            "discovery": {
-                "supported": True,
-                "timeout": 10
-            }
-        }
+        _write_manifest(discovery_mocks.config.connectors_path, "yeelight", _SCAN_MANIFEST_JSON)
         
-        with patch('builtins.open', create=True) as mock_open:
-            mock_open.return_value.__enter__.return_value.read.return_value = json.dumps(manifest)
-            
-            with patch('api.discovery.Path') as mock_path:
-                mock_path.return_value.exists.return_value = True
-                
-                with patch('api.discovery.BackgroundTasks') as mock_bg:
-                    mock_bg_instance = Mock()
-                    mock_bg.return_value = mock_bg_instance
-                    
-                    response = client.post("/api/discovery/scan/yeelight")
-                    
-                    assert response.status_code == 200
-                    result = response.json()
-                    assert result["status"] == "started"
-                    assert "yeelight" in result["message"]
+        response = await async_client.post("/api/discovery/scan/yeelight")
+        
+        assert response.status_code == 200
+        result = response.json()
+        assert result["status"] == "started"
+        assert "yeelight" in result["message"]
     
-    def test_scan_unsupported_integration(self):
+    async def test_scan_unsupported_integration(self, async_client, discovery_mocks):
         """Test scanning integration that doesn't support discovery"""
-        manifest = {
-            "discovery": {
-                "supported": False
-            }
-        }
+        _write_manifest(discovery_mocks.config.connectors_path, "test", _UNSUPPORTED_MANIFEST_JSON)
         
-        with patch('builtins.open', create=True) as mock_open:
-            mock_open.return_value.__enter__.return_value.read.return_value = json.dumps(manifest)
-            
-            with patch('api.discovery.Path') as mock_path:
-                mock_path.return_value.exists.return_value = True
-                
-                response = client.post("/api/discovery/scan/test")
-                
-                assert response.status_code == 400
-                assert "not supported" in response.json()["detail"]
+        response = await async_client.post("/api/discovery/scan/test")
+        
+        assert response.status_code == 400
+        assert "not supported" in response.json()["detail"]
     
-    def test_get_discovery_status(self, mock_discovered_file):
+    async def test_get_discovery_status(self, async_client, discovery_mocks):
         """Test getting discovery status"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value = mock_discovered_file
-            mock_path.return_value.exists.return_value = True
-            
-            response = client.get("/api/discovery/status")
-            
-            assert response.status_code == 200
-            status = response.json()
-            assert status["status"] == "idle"
-            assert status["total_devices"] == 2
-            assert status["added_devices"] == 1
-            assert status["available_devices"] == 1
-            assert status["last_scan"] is not None
+        response = await async_client.get("/api/discovery/status")
+        
+        assert response.status_code == 200
+        status = response.json()
+        assert status["status"] == "idle"
+        assert status["total_devices"] == 2
+        assert status["added_devices"] == 1
+        assert status["available_devices"] == 1
+        assert status["last_scan"] is not None
     
-    def test_remove_discovered_device(self, mock_discovered_file):
+    @pytest.mark.mutates_discovered
+    async def test_remove_discovered_device(self, async_client, discovery_mocks, mock_discovered_file):
         """Test removing a discovered device"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value = mock_discovered_file
-            mock_path.return_value.exists.return_value = True
-            
-            # Read initial data
-            with open(mock_discovered_file, 'r') as f:
-                initial_data = json.load(f)
-            initial_count = len(initial_data["devices"])
-            
-            response = client.delete("/api/discovery/devices/yeelight_192_168_1_100")
-            
-            assert response.status_code == 200
-            result = response.json()
-            assert result["status"] == "success"
-            
-            # Verify device was removed from file
-            with open(mock_discovered_file, 'r') as f:
-                updated_data = json.load(f)
-            assert len(updated_data["devices"]) == initial_count - 1
+        initial_count = len(mock_discovered_file.data["devices"])
+        
+        response = await async_client.delete("/api/discovery/devices/yeelight_192_168_1_100")
+        
+        assert response.status_code == 200
+        result = response.json()
+        assert result["status"] == "success"
+        
+        # Verify device was removed from file
+        updated_data = mock_discovered_file.reload()
+        assert len(updated_data["devices"]) == initial_count - 1
     
-    def test_remove_nonexistent_device(self, mock_discovered_file):
+    async def test_remove_nonexistent_device(self, async_client, discovery_mocks):
         """Test removing a device that doesn't exist"""
-        with patch('api.discovery.Path') as mock_path:
-            mock_path.return_value = mock_discovered_file
-            mock_path.return_value.exists.return_value = True
-            
-            response = client.delete("/api/discovery/devices/nonexistent")
-            
-            assert response.status_code == 404
-            assert "not found" in response.json()["detail"]
+        response = await async_client.delete("/api/discovery/devices/nonexistent")
+        
+        assert response.status_code == 404
+        assert "not found" in response.json()["detail"]
     
-    @pytest.mark.asyncio
-    async def test_websocket_connection(self):
+    def test_websocket_connection(self, client, discovery_mocks):
         """Test WebSocket connection for discovery updates"""
-        from fastapi.testclient import TestClient
-        
-        with TestClient(app) as client:
-            with patch('api.discovery.Path') as mock_path:
-                mock_path.return_value.exists.return_value = True
-                mock_path.return_value.stat.return_value.st_mtime = 123456
-                
-                with patch('builtins.open', create=True) as mock_open:
-                    mock_open.return_value.__enter__.return_value.read.return_value = json.dumps({
-                        "devices": []
-                    })
-                    
-                    with client.websocket_connect("/api/discovery/ws") as websocket:
-                        # Should receive initial data
-                        data = websocket.receive_json()
-                        assert "devices" in data
+        from fastapi import WebSocketDisconnect
+        
+        # The endpoint polls forever; fail its first poll so it closes the socket
+        discovery_mocks.sleep.side_effect = RuntimeError("stop polling")
+        
+        with client.websocket_connect("/api/discovery/ws") as websocket:
+            # Should receive initial data
+            data = websocket.receive_json()
+            assert "devices" in data
+            
+            # Wait for the close so the endpoint is done before the mocks are undone
+            with pytest.raises(WebSocketDisconnect):
+                websocket.receive_json()
     
-    @pytest.mark.asyncio
-    async def test_run_discovery_for_integration(self):
+    @pytest.mark.mutates_discovered
+    async def test_run_discovery_for_integration(self, discovery_mocks, mock_discovered_file):
         """Test running discovery for an integration"""
         from api.discovery import run_discovery_for_integration
         
-        manifest = {
-            "discovery": {
-                "supported": True,
-                "timeout": 1,
-                "network_mode": "host",
-                "command": "python discovery.py"
-            }
-        }
+        discovery_mocks.post.return_value = Mock(status_code=200)
+        discovery_mocks.get.return_value = Mock(status_code=200, json=Mock(return_value={
+            "status": "completed",
+            "devices": [{"id": "test", "name": "Test Device"}]
+        }))
         
-        with patch('builtins.open', create=True) as mock_open:
-            mock_open.return_value.__enter__.return_value.read.return_value = json.dumps(manifest)
-            
-            with patch('api.discovery.Path') as mock_path:
-                mock_path.return_value.exists.return_value = True
-                
-                with patch('api.discovery.docker') as mock_docker:
-                    # Mock container
-                    mock_container = MagicMock()
-                    mock_container.status = "exited"
-                    mock_container.logs.return_value = b'[{"id": "test", "name": "Test Device"}]'
-                    
-                    mock_docker.from_env.return_value.containers.run.return_value = mock_container
-                    
-                    # Run discovery
-                    await run_discovery_for_integration("test_integration")
-                    
-                    # Verify Docker was called
-                    mock_docker.from_env.return_value.containers.run.assert_called_once()
-                    mock_container.remove.assert_called_once_with(force=True)
+        # Run discovery
+        await run_discovery_for_integration("test_integration")
+        
+        # Verify the test-runner was asked and its devices were saved
+        discovery_mocks.post.assert_called_once()
+        discovery_mocks.sleep.assert_awaited_once_with(1)
+        devices = mock_discovered_file.reload()["devices"]
+        found = next(d for d in devices if d["id"] == "test")
+        assert found["integration"] == "test_integration"
+        assert found["added"] is False
 
 
+@pytest.mark.usefixtures("discovery")
 class TestDiscoveryModels:
     """Test Pydantic models"""
     
     def test_discovered_device_model(self):
         """Test DiscoveredDevice model"""
+        from api.discovery import DiscoveredDevice
+        
         device_data = {
             "id": "test_device",
             "name": "Test Device",
@@ -342,6 +369,8 @@ class TestDiscoveryModels:
     
     def test_add_device_request_validation(self):
         """Test AddDeviceRequest validation"""
+        from api.discovery import AddDeviceRequest
+        
         # Valid instance_id
         request = AddDeviceRequest(
             device_id="test",
@@ -360,6 +389,8 @@ class TestDiscoveryModels:
     
     def test_manual_device_request(self):
         """Test ManualDeviceRequest model"""
+        from api.discovery import ManualDeviceRequest
+        
         request = ManualDeviceRequest(
             integration="yeelight",
             instance_id="manual_device",
@@ -5,45 +5,69 @@ Tests for Docker service
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from pathlib import Path
+from types import MappingProxyType
 import docker
+from docker.models.containers import Container
 
 from services.docker_service import DockerService
 
 
+# Read-only so the shared container mock cannot be changed by a test
+_CONTAINER_ATTRS = MappingProxyType({
+    "State": {"Status": "running"},
+    "Created": "2024-01-01T00:00:00Z"
+})
+_CONTAINER_LABELS = MappingProxyType({
+    "iot2mqtt.type": "connector",
+    "iot2mqtt.connector": "test",
+    "iot2mqtt.instance": "instance"
+})
+
+# docker-py formats the explanation in __init__, so build these once
+_NOT_FOUND = docker.errors.NotFound("Container not found")
+_IMAGE_NOT_FOUND = docker.errors.ImageNotFound("Image not found")
+
+
 class TestDockerService:
     """Test Docker service functionality"""
 
-    @pytest.fixture
+    @staticmethod
+    def _configure_client(mock_client, mock_container):
+        mock_client.containers.list.return_value = [mock_container]
+        mock_client.containers.get.return_value = mock_container
+        mock_client.containers.run.return_value = mock_container
+        mock_client.images.build.return_value = (Mock(), [])
+        mock_client.images.get.return_value = Mock()
+        mock_client.ping.return_value = True
+
+    @pytest.fixture(scope="module")
     def mock_docker_client(self):
-        """Mock Docker client"""
+        """Mock Docker client, built once per module and reset between tests"""
         mock_client = Mock()
 
         # Mock container
-        mock_container = Mock()
+        mock_container = Mock(spec=Container)
         mock_container.short_id = "abc123"
         mock_container.name = "iot2mqtt_test_instance"
         mock_container.status = "running"
-        mock_container.attrs = {
-            "State": {"Status": "running"},
-            "Created": "2024-01-01T00:00:00Z"
-        }
+        mock_container.attrs = _CONTAINER_ATTRS
         mock_container.ports = {}
-        mock_container.labels = {
-            "iot2mqtt.type": "connector",
-            "iot2mqtt.connector": "test",
-            "iot2mqtt.instance": "instance"
-        }
+        mock_container.labels = _CONTAINER_LABELS
         mock_container.image.tags = ["iot2mqtt_test:latest"]
 
-        mock_client.containers.list.return_value = [mock_container]
-        mock_client.containers.get.return_value = mock_container
-        mock_client.containers.run.return_value = mock_container
-        mock_client.images.build.return_value = (Mock(), [])
-        mock_client.images.get.return_value = Mock()
-        mock_client.ping.return_value = True
+        self._configure_client(mock_client, mock_container)
 
         return mock_client
 
+    @pytest.fixture(autouse=True)
+    def _reset_docker_client(self, mock_docker_client):
+        """Undo calls, return values and side effects a test set on the shared client"""
+        mock_container = mock_docker_client.containers.get.return_value
+        yield
+        mock_docker_client.reset_mock(return_value=True, side_effect=True)
+        mock_container.reset_mock(return_value=True, side_effect=True)
+        self._configure_client(mock_docker_client, mock_container)
+
     @pytest.fixture
     def docker_service(self, setup_test_env, mock_docker_client):
         """Create DockerService with mocked client"""
@@ -104,7 +128,7 @@ class TestDockerService:
 
     def test_get_container_not_found(self, docker_service, mock_docker_client):
         """Test getting non-existent container"""
-        mock_docker_client.containers.get.side_effect = docker.errors.NotFound("Container not found")
+        mock_docker_client.containers.get.side_effect = _NOT_FOUND
 
         container = docker_service.get_container("nonexistent")
 
@@ -122,45 +146,20 @@ class TestDockerService:
         assert info["name"] == "iot2mqtt_test_instance"
         assert info["status"] == "running"
 
-    def test_start_container(self, docker_service, mock_docker_client):
-        """Test starting container"""
-        mock_container = mock_docker_client.containers.get.return_value
-        mock_container.start.return_value = None
-
-        result = docker_service.start_container("test_container")
-
-        assert result is True
-        mock_container.start.assert_called_once()
-
-    def test_stop_container(self, docker_service, mock_docker_client):
-        """Test stopping container"""
-        mock_container = mock_docker_client.containers.get.return_value
-        mock_container.stop.return_value = None
-
-        result = docker_service.stop_container("test_container")
-
-        assert result is True
-        mock_container.stop.assert_called_once_with(timeout=10)
-
-    def test_restart_container(self, docker_service, mock_docker_client):
-        """Test restarting container"""
-        mock_container = mock_docker_client.containers.get.return_value
-        mock_container.restart.return_value = None
-
-        result = docker_service.restart_container("test_container")
-
-        assert result is True
-        mock_container.restart.assert_called_once_with(timeout=10)
-
-    def test_remove_container(self, docker_service, mock_docker_client):
-        """Test removing container"""
+    @pytest.mark.parametrize("method,mock_attr,kwargs", [
+        ("start_container", "start", {}),
+        ("stop_container", "stop", {"timeout": 10}),
+        ("restart_container", "restart", {"timeout": 10}),
+        ("remove_container", "remove", {"force": False}),
+    ], ids=["start", "stop", "restart", "remove"])
+    def test_container_lifecycle(self, docker_service, mock_docker_client, method, mock_attr, kwargs):
+        """Test starting, stopping, restarting and removing a container"""
         mock_container = mock_docker_client.containers.get.return_value
-        mock_container.remove.return_value = None
 
-        result = docker_service.remove_container("test_container")
+        result = getattr(docker_service, method)("test_container")
 
         assert result is True
-        mock_container.remove.assert_called_once_with(force=False)
+        getattr(mock_container, mock_attr).assert_called_once_with(**kwargs)
 
     def test_build_image_success(self, docker_service, mock_docker_client, setup_test_env):
         """Test successful image building"""
@@ -211,7 +210,7 @@ class TestDockerService:
 
         # Mock image doesn't exist, then exists after build
         mock_docker_client.images.get.side_effect = [
-            docker.errors.ImageNotFound("Image not found"),
+            _IMAGE_NOT_FOUND,
             Mock()  # After build
         ]
 
@@ -15,23 +15,36 @@ from fastapi import FastAPI
 class TestInstancesAPI:
     """Test Instances API endpoints"""
 
-    @pytest.fixture
-    def router(self, setup_test_env):
+    @pytest.fixture(scope="module")
+    def router(self, tmp_path_factory):
         """Import router with test environment"""
-        from api.instances import router
+        base_path = tmp_path_factory.mktemp("instances_api")
+        with pytest.MonkeyPatch.context() as mp:
+            # api.instances builds its services at import time, so point them
+            # at a scratch directory rather than the repository
+            mp.setenv("IOT2MQTT_PATH", str(base_path))
+            mp.setenv("IOT2MQTT_SECRETS_PATH", str(base_path / "secrets"))
+            from api.instances import router
         return router
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def app(self, router):
-        """Create test FastAPI app"""
+        """Create test FastAPI app, shared by every test in this module"""
         app = FastAPI()
         app.include_router(router)
         return app
 
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def client(self, app):
-        """Create test client"""
-        return TestClient(app)
+        """Create test client, shared by every test in this module"""
+        with TestClient(app) as test_client:
+            yield test_client
+
+    @pytest.fixture(autouse=True)
+    def _clear_dependency_overrides(self, app):
+        """Drop dependency overrides a test left on the shared app"""
+        yield
+        app.dependency_overrides.clear()
 
     @pytest.fixture
     def mock_services(self):
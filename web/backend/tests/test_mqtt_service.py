@@ -5,10 +5,12 @@ Tests for MQTT service
 import pytest
 import asyncio
 import json
+import threading
 from unittest.mock import Mock, patch, MagicMock, AsyncMock
 from datetime import datetime
 
 from services.mqtt_service import MQTTService
+from services.topic_index import TopicCache
 import paho.mqtt.client as mqtt
 
 
@@ -111,6 +113,35 @@ class TestMQTTService:
         # Should subscribe to all topics
         mock_mqtt_client.subscribe.assert_called_with("#", qos=1)
 
+    def test_on_connect_shared_subscription(self, mqtt_config, mock_mqtt_client):
+        """Test on_connect uses a shared subscription when a group is configured"""
+        service = MQTTService({**mqtt_config, "shared_group": "iot2mqtt_web"})
+
+        service._on_connect(mock_mqtt_client, None, None, 0, None)
+
+        topics = [c.args[0] for c in mock_mqtt_client.subscribe.call_args_list]
+        # Shared subscriptions get no retained messages, so a plain one is kept too
+        assert topics == ["$share/iot2mqtt_web/TestTopic/#", "TestTopic/#"]
+
+    def test_on_message_shared_group_drops_live_state_copies(self, mqtt_config):
+        """Test only retained messages are taken from the non-shared subscription"""
+        service = MQTTService({**mqtt_config, "shared_group": "iot2mqtt_web"})
+        service._dispatch_to_handlers = Mock()
+
+        def message(topic, retain, subscription_ids):
+            msg = Mock(topic=topic, payload=b'{"on": true}', retain=retain, qos=1)
+            msg.properties.SubscriptionIdentifier = subscription_ids
+            return msg
+
+        service._on_message(None, None, message("TestTopic/a", True, [2]))
+        service._on_message(None, None, message("TestTopic/b", False, [2]))
+        service._on_message(None, None, message("TestTopic/c", False, [1]))
+        service._on_message(None, None, message("TestTopic/d", False, [1, 2]))
+
+        assert set(service.topic_cache) == {"TestTopic/a", "TestTopic/c", "TestTopic/d"}
+        dispatched = [c.args[0] for c in service._dispatch_to_handlers.call_args_list]
+        assert dispatched == ["TestTopic/a", "TestTopic/c", "TestTopic/d"]
+
     def test_on_disconnect_callback(self, mqtt_service, mock_mqtt_client):
         """Test on_disconnect callback"""
         mqtt_service.connected = True
@@ -153,6 +184,54 @@ class TestMQTTService:
         assert cached["value"] == "plain text message"
         assert cached["retained"] is True
 
+    def test_on_message_scalar_payloads(self, mqtt_service):
+        """Test on_message handles short plain and JSON constant payloads"""
+        expected = {b'ON': "ON", b'42': 42, b'true': True, b'false': False, b'null': None}
+
+        for raw, value in expected.items():
+            mock_msg = Mock()
+            mock_msg.topic = "test/topic"
+            mock_msg.payload = raw
+            mock_msg.retain = True
+            mock_msg.qos = 0
+
+            mqtt_service._on_message(None, None, mock_msg)
+
+            assert mqtt_service.topic_cache["test/topic"]["value"] == value
+
+    def test_on_message_evicts_least_recently_updated(self, mqtt_config):
+        """Test topic cache stays within cache_max_topics"""
+        service = MQTTService({**mqtt_config, "cache_max_topics": 2})
+
+        for topic in ("a/1", "a/2", "a/1", "a/3"):
+            mock_msg = Mock()
+            mock_msg.topic = topic
+            mock_msg.payload = b'1'
+            mock_msg.retain = True
+            mock_msg.qos = 0
+            service._on_message(None, None, mock_msg)
+
+        assert list(service.topic_cache.keys()) == ["a/1", "a/3"]
+        assert set(service.topic_cache.iter_prefix("a")) == {"a/1", "a/3"}
+
+    @pytest.mark.parametrize("suffix", ["cmd", "cmd/response", "events", "telemetry"])
+    @pytest.mark.parametrize("retain", [False, True])
+    def test_on_message_transient_topics(self, mqtt_service, suffix, retain):
+        """Test command/event topics are always dispatched but only cached when retained"""
+        mock_msg = Mock()
+        mock_msg.topic = f"TestTopic/v1/instances/i1/devices/d1/{suffix}"
+        mock_msg.payload = b'{"id": "1"}'
+        mock_msg.retain = retain
+        mock_msg.qos = 1
+
+        with patch.object(mqtt_service, "_dispatch_to_handlers") as dispatch:
+            mqtt_service._on_message(None, None, mock_msg)
+
+        dispatch.assert_called_once_with(mock_msg.topic, {"id": "1"}, retain)
+        expected = [mock_msg.topic] if retain else []
+        assert list(mqtt_service.topic_cache) == expected
+        assert list(mqtt_service.topic_cache.iter_prefix("TestTopic/v1/instances/i1")) == expected
+
     def test_on_message_empty_payload(self, mqtt_service):
         """Test on_message callback with empty payload (topic deletion)"""
         # First add a topic
@@ -179,7 +258,7 @@ class TestMQTTService:
         assert result is True
         mock_mqtt_client.publish.assert_called_once_with(
             "sensors/room1",
-            '{"temperature": 25.5, "humidity": 60}',
+            b'{"temperature":25.5,"humidity":60}',
             qos=1,
             retain=True
         )
@@ -239,6 +318,15 @@ class TestMQTTService:
         assert any(t["topic"] == "sensors/temp" and t["value"] == 25.5 for t in topics)
         assert any(t["topic"] == "sensors/humidity" and t["value"] == 60 for t in topics)
 
+    def test_iso_timestamp_second_precision(self, mqtt_service):
+        """Test timestamps are formatted per second and reused within it"""
+        first = mqtt_service.iso_timestamp(1700000000.25)
+        second = mqtt_service.iso_timestamp(1700000000.75)
+
+        assert first == datetime.fromtimestamp(1700000000).isoformat()
+        assert second is first
+        assert mqtt_service.iso_timestamp(1700000001.0) != first
+
     def test_get_topic_value(self, mqtt_service):
         """Test getting cached topic value"""
         mqtt_service.topic_cache["test/topic"] = {
@@ -252,6 +340,13 @@ class TestMQTTService:
         value = mqtt_service.get_topic_value("nonexistent/topic")
         assert value is None
 
+        # Entries cached from MQTT messages get an ISO timestamp, as in get_topics_list
+        mqtt_service._dispatch_to_handlers = Mock()
+        mqtt_service._on_message(None, None, Mock(topic="test/live", payload=b"1", retain=True, qos=0))
+        value = mqtt_service.get_topic_value("test/live")
+        assert isinstance(value["timestamp"], str)
+        assert value["timestamp"] == mqtt_service.get_topics_list()[-1]["timestamp"]
+
     def test_send_command(self, mqtt_service, mock_mqtt_client):
         """Test sending device command"""
         mqtt_service.client = mock_mqtt_client
@@ -261,7 +356,7 @@ class TestMQTTService:
         cmd_id = mqtt_service.send_command("instance1", "device1", command)
 
         assert cmd_id is not None
-        assert len(cmd_id) == 36  # UUID length
+        assert len(cmd_id) == 32  # UUID hex length
 
         # Check if publish was called with correct topic and payload
         call_args = mock_mqtt_client.publish.call_args
@@ -288,6 +383,21 @@ class TestMQTTService:
         state = mqtt_service.get_device_state("instance1", "nonexistent")
         assert state is None
 
+    def test_get_device_state_single_lookup(self, mqtt_service):
+        """Test the state is read in one lookup, so an eviction in between can't raise"""
+        state_topic = "TestTopic/v1/instances/instance1/devices/device1/state"
+
+        class EvictingCache(TopicCache):
+            # Simulates paho evicting the topic right after a membership check
+            def __contains__(self, topic):
+                if super().__contains__(topic):
+                    del self[topic]
+                return True
+
+        mqtt_service.topic_cache = EvictingCache({state_topic: {"value": {"power": "on"}}})
+
+        assert mqtt_service.get_device_state("instance1", "device1") == {"power": "on"}
+
     def test_get_instance_devices(self, mqtt_service):
         """Test getting list of devices for instance"""
         # Add device topics to cache
@@ -321,6 +431,91 @@ class TestMQTTService:
         assert len(mqtt_service.websocket_handlers) == 1
         assert handler2 in mqtt_service.websocket_handlers
 
+    @pytest.mark.asyncio
+    async def test_dispatch_to_handlers_batches_messages(self, mqtt_service):
+        """Test messages from the MQTT thread reach every handler in order"""
+        received = {"h1": [], "h2": []}
+
+        async def handler1(topic, payload, retained):
+            received["h1"].append(topic)
+
+        async def handler2(topic, payload, retained):
+            received["h2"].append(topic)
+
+        mqtt_service.attach_loop(asyncio.get_running_loop())
+        mqtt_service.add_websocket_handler(handler1)
+        mqtt_service.add_websocket_handler(handler2)
+
+        topics = [f"test/{i}" for i in range(1000)]
+        await asyncio.to_thread(
+            lambda: [mqtt_service._dispatch_to_handlers(t, "v", False) for t in topics]
+        )
+
+        for _ in range(100):
+            if len(received["h1"]) == len(topics) and len(received["h2"]) == len(topics):
+                break
+            await asyncio.sleep(0.01)
+
+        assert received["h1"] == topics
+        assert received["h2"] == topics
+        assert mqtt_service._drain_scheduled is False
+
+        mqtt_service.remove_websocket_handler(handler1)
+        mqtt_service.remove_websocket_handler(handler2)
+        await asyncio.sleep(0)
+
+    @pytest.mark.asyncio
+    async def test_slow_handler_does_not_block_others(self, mqtt_service):
+        """Test a stalled handler neither delays other handlers nor grows without bound"""
+        from services.mqtt_service import _HANDLER_QUEUE_SIZE
+
+        gate = asyncio.Event()
+        slow_received, fast_received = [], []
+
+        async def slow_handler(topic, payload, retained):
+            slow_received.append(topic)
+            await gate.wait()
+
+        async def fast_handler(topic, payload, retained):
+            fast_received.append(topic)
+
+        mqtt_service.attach_loop(asyncio.get_running_loop())
+        mqtt_service.add_websocket_handler(slow_handler)
+        mqtt_service.add_websocket_handler(fast_handler)
+
+        # Let the slow handler block on its first message
+        mqtt_service._dispatch_to_handlers("test/first", "v", False)
+        for _ in range(100):
+            if slow_received:
+                break
+            await asyncio.sleep(0.01)
+
+        # Send in chunks the fast handler keeps up with; only the slow one overflows
+        topics = [f"test/{i}" for i in range(_HANDLER_QUEUE_SIZE + 100)]
+        for start in range(0, len(topics), 100):
+            for topic in topics[start:start + 100]:
+                mqtt_service._dispatch_to_handlers(topic, "v", False)
+            for _ in range(100):
+                if len(fast_received) == min(start + 100, len(topics)) + 1:
+                    break
+                await asyncio.sleep(0.01)
+
+        # The fast handler got everything while the slow one is still stuck
+        assert fast_received == ["test/first"] + topics
+        assert slow_received == ["test/first"]
+
+        # Once released, the slow handler only sees the newest messages
+        gate.set()
+        for _ in range(100):
+            if len(slow_received) == _HANDLER_QUEUE_SIZE + 1:
+                break
+            await asyncio.sleep(0.01)
+        assert slow_received == ["test/first"] + topics[-_HANDLER_QUEUE_SIZE:]
+
+        mqtt_service.remove_websocket_handler(slow_handler)
+        mqtt_service.remove_websocket_handler(fast_handler)
+        await asyncio.sleep(0)
+
     def test_clear_instance_topics(self, mqtt_service, mock_mqtt_client):
         """Test clearing all topics for an instance"""
         mqtt_service.client = mock_mqtt_client
@@ -349,6 +544,75 @@ class TestMQTTService:
                           if "inst2" in t]
         assert len(remaining_topics) == 1
 
+    def test_clear_instance_topics_includes_uncached_topics(self, mqtt_service, mock_mqtt_client):
+        """Test clearing also covers well-known topics that are not in the cache"""
+        mqtt_service.client = mock_mqtt_client
+        mqtt_service.connected = True
+        mqtt_service.topic_cache.update({
+            "TestTopic/v1/instances/inst1/devices/dev1/state": {"value": {}},
+            "TestTopic/v1/instances/inst1/custom": {"value": 1}
+        })
+
+        assert mqtt_service.clear_instance_topics("inst1") is True
+
+        cleared = [c.args[0] for c in mock_mqtt_client.publish.call_args_list]
+        assert len(cleared) == len(set(cleared))
+        assert "TestTopic/v1/instances/inst1/custom" in cleared
+        assert "TestTopic/v1/instances/inst1/status" in cleared
+        assert "TestTopic/v1/instances/inst1/meta/info" in cleared
+        assert "TestTopic/v1/instances/inst1/devices/dev1/state" in cleared
+        assert "TestTopic/v1/instances/inst1/devices/dev1/events" in cleared
+
+    def test_clear_instance_topics_ignores_similar_ids(self, mqtt_service, mock_mqtt_client):
+        """Test clearing an instance keeps instances whose id shares its prefix"""
+        mqtt_service.client = mock_mqtt_client
+        mqtt_service.connected = True
+
+        mqtt_service.topic_cache.update({
+            "TestTopic/v1/instances/inst1/status": {"value": "online"},
+            "TestTopic/v1/instances/inst10/status": {"value": "online"}
+        })
+
+        assert mqtt_service.clear_instance_topics("inst1") is True
+        assert list(mqtt_service.topic_cache.keys()) == ["TestTopic/v1/instances/inst10/status"]
+
+    @pytest.mark.asyncio
+    async def test_clear_instance_topics_async(self, mqtt_service, mock_mqtt_client):
+        """Test async clear runs the cleanup off the event loop"""
+        mqtt_service.client = mock_mqtt_client
+        mqtt_service.connected = True
+        mqtt_service.topic_cache["TestTopic/v1/instances/inst1/status"] = {"value": "online"}
+
+        result = await mqtt_service.clear_instance_topics_async("inst1")
+
+        assert result is True
+        assert len(mqtt_service.topic_cache) == 0
+
+    def test_cache_access_is_serialized_across_threads(self, mqtt_service, mock_mqtt_client):
+        """Test paho writes and threaded clears both wait for the cache lock"""
+        mqtt_service.client = mock_mqtt_client
+        mqtt_service.connected = True
+        mqtt_service._dispatch_to_handlers = Mock()
+        topic = "TestTopic/v1/instances/inst1/status"
+        msg = Mock(topic=topic, payload=b'"online"', retain=True, qos=0)
+
+        with mqtt_service._cache_lock:
+            writer = threading.Thread(target=mqtt_service._on_message, args=(None, None, msg))
+            clearer = threading.Thread(target=mqtt_service.clear_instance_topics, args=("inst1",))
+            writer.start()
+            writer.join(0.05)
+            assert writer.is_alive()
+            assert topic not in mqtt_service.topic_cache
+
+            clearer.start()
+            clearer.join(0.05)
+            assert clearer.is_alive()
+            mock_mqtt_client.publish.assert_not_called()
+
+        writer.join()
+        clearer.join()
+        assert mock_mqtt_client.publish.called
+
     def test_clear_all_iot2mqtt_topics(self, mqtt_service, mock_mqtt_client):
         """Test clearing all IoT2MQTT topics"""
         mqtt_service.client = mock_mqtt_client
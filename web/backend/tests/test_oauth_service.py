@@ -0,0 +1,151 @@
+"""
+Tests for OAuthService
+"""
+
+import builtins
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from services.oauth_service import OAuthService
+
+
+def _write_provider(base, name="demo"):
+    config_dir = base / "config" / "oauth"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    (config_dir / f"{name}.json").write_text(json.dumps({
+        "client_id": "client",
+        "scopes": ["read"],
+        "authorization_endpoint": "https://auth.example.com/authorize",
+        "token_endpoint": "https://auth.example.com/token",
+        "redirect_uri": "https://app.example.com/callback"
+    }))
+
+
+def _index_lines(service):
+    return [json.loads(line) for line in service.state_index_path.read_text().splitlines()]
+
+
+class TestOAuthService:
+    """Test OAuth session storage and provider configs"""
+
+    def test_find_session_by_state_uses_index(self, setup_test_env):
+        """Test sessions are found through the state index"""
+        _write_provider(setup_test_env)
+        service = OAuthService(base_path=setup_test_env)
+
+        created = service.create_session("demo")
+
+        assert _index_lines(service) == [{"state": created["state"], "session": created["session_id"]}]
+
+        session_id, session = service._find_session_by_state(created["state"])
+        assert session_id == created["session_id"]
+        assert session["provider"] == "demo"
+
+    def test_missing_index_is_built_from_session_files(self, setup_test_env):
+        """Test sessions written before the index existed are indexed once"""
+        service = OAuthService(base_path=setup_test_env)
+        (service.sessions_path / "legacy.json").write_text(json.dumps({
+            "id": "legacy",
+            "provider": "demo",
+            "state": "legacy-state",
+            "status": "pending"
+        }))
+        (service.sessions_path / "done.json").write_text(json.dumps({
+            "id": "done",
+            "provider": "demo",
+            "state": "done-state",
+            "status": "authorized"
+        }))
+
+        session_id, session = service._find_session_by_state("legacy-state")
+
+        assert session_id == "legacy"
+        assert session["state"] == "legacy-state"
+        assert _index_lines(service) == [{"state": "legacy-state", "session": "legacy"}]
+        assert service._find_session_by_state("done-state") == ("", None)
+
+    def test_unknown_state_does_not_open_session_files(self, setup_test_env):
+        """Test a miss is answered from the index alone"""
+        service = OAuthService(base_path=setup_test_env)
+        service._write_session("abc", {"id": "abc", "state": "s1", "status": "pending"})
+
+        with patch.object(builtins, "open", wraps=builtins.open) as mock_open:
+            assert service._find_session_by_state("missing") == ("", None)
+
+        opened = [str(call.args[0]) for call in mock_open.call_args_list]
+        assert not [path for path in opened if path.endswith(".json")]
+
+    def test_completed_session_is_dropped_from_index(self, setup_test_env):
+        """Test a state can't be looked up again once its session left pending"""
+        service = OAuthService(base_path=setup_test_env)
+
+        service._write_session("abc", {"id": "abc", "state": "s1", "status": "pending"})
+        service._write_session("abc", {"id": "abc", "state": "s1", "status": "authorized"})
+
+        assert service._find_session_by_state("s1") == ("", None)
+        assert service._load_state_index().sessions == {}
+
+    def test_index_is_compacted(self, setup_test_env):
+        """Test superseded index lines are eventually rewritten away"""
+        service = OAuthService(base_path=setup_test_env)
+
+        with patch("services.oauth_service._STATE_INDEX_COMPACT_MIN", 4):
+            for i in range(20):
+                service._write_session(f"s{i}", {"id": f"s{i}", "state": f"st{i}", "status": "pending"})
+                service._write_session(f"s{i}", {"id": f"s{i}", "state": f"st{i}", "status": "authorized"})
+            service._write_session("live", {"id": "live", "state": "st-live", "status": "pending"})
+
+        assert len(_index_lines(service)) <= 10
+        assert service._find_session_by_state("st-live")[0] == "live"
+        assert service._find_session_by_state("st3") == ("", None)
+
+    def test_partial_index_line_is_ignored(self, setup_test_env):
+        """Test an unfinished trailing line doesn't hide the entries before it"""
+        service = OAuthService(base_path=setup_test_env)
+        service._write_session("abc", {"id": "abc", "state": "s1", "status": "pending"})
+
+        with open(service.state_index_path, "ab") as handle:
+            handle.write(b'{"state": "s2", "ses')
+
+        assert service._find_session_by_state("s1")[0] == "abc"
+        assert service._find_session_by_state("s2") == ("", None)
+
+    def test_load_provider_reloads_after_edit(self, setup_test_env):
+        """Test cached provider configs are refreshed when the file changes"""
+        _write_provider(setup_test_env)
+        service = OAuthService(base_path=setup_test_env)
+
+        first = service.load_provider("demo")
+        first["client_id"] = "mutated"
+        first["scopes"].append("mutated")
+        assert service.load_provider("demo")["client_id"] == "client"
+        assert service.load_provider("demo")["scopes"] == ["read"]
+
+        config_file = service.config_path / "demo.json"
+        config = json.loads(config_file.read_text())
+        config["client_id"] = "updated"
+        config_file.write_text(json.dumps(config))
+        stat = config_file.stat()
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert service.load_provider("demo")["client_id"] == "updated"
+
+    def test_load_provider_missing(self, setup_test_env):
+        """Test loading an unconfigured provider raises FileNotFoundError"""
+        service = OAuthService(base_path=setup_test_env)
+
+        with pytest.raises(FileNotFoundError):
+            service.load_provider("missing")
+
+    def test_write_session_replaces_file_atomically(self, setup_test_env):
+        """Test session writes leave no temp files behind"""
+        service = OAuthService(base_path=setup_test_env)
+
+        service._write_session("abc", {"id": "abc", "state": "s1", "status": "pending"})
+        service._write_session("abc", {"id": "abc", "state": "s1", "status": "authorized"})
+
+        assert service.get_session("abc")["status"] == "authorized"
+        assert [p.name for p in service.sessions_path.iterdir() if p.name.endswith(".tmp")] == []
@@ -10,7 +10,7 @@ from unittest.mock import patch, Mock
 import pytest
 from cryptography.fernet import Fernet
 
-from services.secrets_manager import SecretsManager
+from services.secrets_manager import SecretsManager, get_secrets_manager
 
 
 class TestSecretsManagerExtended:
@@ -267,7 +267,7 @@ class TestSecretsManagerExtended:
         manager = SecretsManager(str(secrets_path))
 
         # Mock JSON serialization error
-        with patch('json.dumps', side_effect=TypeError("Not serializable")):
+        with patch('orjson.dumps', side_effect=TypeError("Not serializable")):
             with pytest.raises(TypeError):
                 manager.encrypt_credentials({"invalid": object()})
 
@@ -370,4 +370,165 @@ class TestSecretsManagerExtended:
         encrypted = manager.encrypt_credentials(empty_secrets)
         decrypted = manager.decrypt_credentials(encrypted)
 
-        assert decrypted == empty_secrets
\ No newline at end of file
+        assert decrypted == empty_secrets
+
+    def test_cipher_shared_between_instances(self, setup_test_env):
+        """Test that managers on the same key reuse one cipher until rotation"""
+        secrets_path = setup_test_env / "secrets"
+        manager1 = SecretsManager(str(secrets_path))
+        manager2 = SecretsManager(str(secrets_path))
+
+        assert manager1.cipher is manager2.cipher
+
+        manager1.save_instance_secret("test_instance", {"api_key": "key"})
+        assert manager1.rotate_master_key(backup=False) is True
+
+        manager3 = SecretsManager(str(secrets_path))
+        assert manager3.cipher is not manager2.cipher
+        assert manager3.load_instance_secret("test_instance") == {"api_key": "key"}
+
+    def test_derive_key_matches_pbkdf2hmac(self, setup_test_env):
+        """Test that derived keys stay compatible with cryptography's PBKDF2HMAC"""
+        import base64
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        salt = b"0123456789abcdef"
+        key, _ = manager._derive_key_from_password("test_password_123", salt, iterations=1000)
+
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=1000)
+        assert key == base64.urlsafe_b64encode(kdf.derive(b"test_password_123"))
+
+    def test_extract_sensitive_fields_empty_keys(self, setup_test_env):
+        """Test that an empty sensitive key list extracts nothing"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        config = {"password": "pass", "nested": {"token": "tok"}}
+
+        clean_config, sensitive_data = manager.extract_sensitive_fields(config, [])
+
+        assert sensitive_data == {}
+        assert clean_config == {"password": "pass", "nested": {"token": "tok"}}
+
+    def test_extract_and_inject_deeply_nested(self, setup_test_env):
+        """Test that nesting deeper than the recursion limit is handled"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        depth = 2000
+        config = leaf = {}
+        for _ in range(depth):
+            leaf["n"] = {}
+            leaf = leaf["n"]
+        leaf["password"] = "deep_pass"
+
+        clean_config, sensitive_data = manager.extract_sensitive_fields(config)
+        secret_path = ".".join(["n"] * depth + ["password"])
+        assert sensitive_data == {secret_path: "deep_pass"}
+
+        result = manager.inject_secrets(clean_config, sensitive_data)
+        leaf = result
+        for _ in range(depth):
+            leaf = leaf["n"]
+        assert leaf["password"] == "deep_pass"
+
+    def test_encrypt_uses_versioned_aesgcm_format(self, setup_test_env):
+        """Test that new secrets carry the AES-GCM version byte"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        encrypted = manager.encrypt_credentials({"api_key": "key"})
+
+        assert encrypted[:1] == b"\x02"
+        assert manager.decrypt_credentials(encrypted) == {"api_key": "key"}
+
+    def test_decrypt_legacy_fernet_secret(self, setup_test_env):
+        """Test that secrets written with Fernet remain readable and rotate to AES-GCM"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        legacy = Fernet(manager.master_key_path.read_bytes()).encrypt(b'{"api_key":"old"}')
+        (manager.instances_path / "legacy.secret").write_bytes(legacy)
+
+        assert manager.load_instance_secret("legacy") == {"api_key": "old"}
+
+        assert manager.rotate_master_key(backup=False) is True
+        assert (manager.instances_path / "legacy.secret").read_bytes()[:1] == b"\x02"
+        assert manager.load_instance_secret("legacy") == {"api_key": "old"}
+
+    def test_extract_sensitive_fields_mixed_case_keys(self, setup_test_env):
+        """Test that custom sensitive keys match regardless of case"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        config = {"DeviceToken": "tok", "host": "10.0.0.2"}
+
+        clean_config, sensitive_data = manager.extract_sensitive_fields(config, ["deviceTOKEN"])
+
+        assert sensitive_data == {"DeviceToken": "tok"}
+        assert clean_config["host"] == "10.0.0.2"
+
+    def test_save_secret_tightens_existing_file_permissions(self, setup_test_env):
+        """Test that overwriting a secret resets its permissions to owner read-only"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        secret_file = manager.instances_path / "test_instance.secret"
+        secret_file.write_bytes(b"stale")
+        os.chmod(secret_file, 0o644)
+
+        manager.save_instance_secret("test_instance", {"api_key": "key"})
+
+        assert oct(secret_file.stat().st_mode)[-3:] == "400"
+        assert manager.load_instance_secret("test_instance") == {"api_key": "key"}
+
+    def test_load_large_instance_secret(self, setup_test_env):
+        """Test loading a secret large enough to be memory-mapped"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        credentials = {"ssl_cert": "A" * 20000, "password": "pass"}
+        secret_path = manager.save_instance_secret("large_instance", credentials)
+
+        assert Path(secret_path).stat().st_size > 4096
+        assert manager.load_instance_secret("large_instance") == credentials
+
+    def test_inject_secrets_path_with_double_underscore(self, setup_test_env):
+        """Test that secret paths containing '__' are restored"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        config = {"mqtt__auth": {"password": "pass"}}
+
+        clean_config, sensitive_data = manager.extract_sensitive_fields(config)
+        assert clean_config["mqtt__auth"]["password"] == "__SECRET__mqtt__auth.password__"
+
+        result = manager.inject_secrets(clean_config, sensitive_data)
+        assert result["mqtt__auth"]["password"] == "pass"
+
+    def test_extract_sensitive_fields_mutates_in_place(self, setup_test_env):
+        """Test that extraction rewrites the given config instead of copying it"""
+        secrets_path = setup_test_env / "secrets"
+        manager = SecretsManager(str(secrets_path))
+
+        config = {"password": "pass", "nested": {"token": "tok"}}
+
+        clean_config, _ = manager.extract_sensitive_fields(config)
+
+        assert clean_config is config
+        assert config["password"] == "__SECRET__password__"
+        assert config["nested"]["token"] == "__SECRET__nested.token__"
+
+    def test_get_secrets_manager_shared_per_path(self, setup_test_env):
+        """Test that the factory returns one manager per secrets path"""
+        secrets_path = setup_test_env / "secrets"
+
+        manager = get_secrets_manager(str(secrets_path))
+
+        assert get_secrets_manager(str(secrets_path)) is manager
+        assert get_secrets_manager() is manager  # path taken from IOT2MQTT_SECRETS_PATH
+        assert get_secrets_manager(str(setup_test_env / "other")) is not manager
@@ -0,0 +1,105 @@
+"""
+Tests for the MQTT topic prefix index
+"""
+
+import pytest
+
+from services.topic_index import TopicCache, TopicEntry, TopicTrie
+
+
+class TestTopicTrie:
+    """Test TopicTrie prefix queries"""
+
+    def test_iter_prefix_matches_whole_segments(self):
+        """Prefix queries must not match sibling topics sharing a name prefix"""
+        trie = TopicTrie()
+        for topic in ("base/inst1/status", "base/inst1/devices/d1/state", "base/inst10/status"):
+            trie.insert(topic)
+
+        assert set(trie.iter_prefix("base/inst1")) == {
+            "base/inst1/status",
+            "base/inst1/devices/d1/state",
+        }
+        assert list(trie.iter_prefix("base/missing")) == []
+
+    def test_iter_prefix_includes_exact_topic(self):
+        """A topic equal to the prefix is yielded along with its children"""
+        trie = TopicTrie()
+        trie.insert("a/b")
+        trie.insert("a/b/c")
+
+        assert set(trie.iter_prefix("a/b")) == {"a/b", "a/b/c"}
+
+    def test_remove_prunes_empty_branches(self):
+        """Removing the last topic under a branch drops the branch"""
+        trie = TopicTrie()
+        trie.insert("a/b/c")
+        trie.insert("a/d")
+
+        trie.remove("a/b/c")
+        trie.remove("a/b/c")  # Removing twice is a no-op
+
+        assert trie.children("a") == ["d"]
+        assert list(trie.iter_prefix("a")) == ["a/d"]
+
+    def test_children(self):
+        """Test listing direct child segments"""
+        trie = TopicTrie()
+        trie.insert("i/devices/dev1/state")
+        trie.insert("i/devices/dev2/availability")
+
+        assert sorted(trie.children("i/devices")) == ["dev1", "dev2"]
+        assert trie.children("nope") == []
+
+    def test_children_with(self):
+        """Test listing children that have a given topic below them"""
+        trie = TopicTrie()
+        trie.insert("i/devices/dev1/state")
+        trie.insert("i/devices/dev1/state/power")
+        trie.insert("i/devices/dev2/availability")
+        trie.insert("i/devices/dev3/state/power")
+
+        assert trie.children_with("i/devices", "state") == ["dev1"]
+        assert trie.children_with("i/devices", "state/power") == ["dev1", "dev3"]
+        assert trie.children_with("nope", "state") == []
+
+
+class TestTopicCache:
+    """Test TopicCache keeps its index in sync with the stored values"""
+
+    def test_mutations_update_index(self):
+        cache = TopicCache({"a/1": 1})
+        cache["a/2"] = 2
+        cache.update({"a/3": 3})
+        cache.setdefault("a/4", 4)
+
+        assert set(cache.iter_prefix("a")) == {"a/1", "a/2", "a/3", "a/4"}
+
+        del cache["a/1"]
+        assert cache.pop("a/2") == 2
+        assert cache.pop("a/missing", None) is None
+
+        assert set(cache.iter_prefix("a")) == {"a/3", "a/4"}
+
+        cache.clear()
+        assert list(cache.iter_prefix("a")) == []
+
+
+class TestTopicEntry:
+    """Test TopicEntry dict-style access"""
+
+    def test_mapping_access(self):
+        entry = TopicEntry({"power": "on"}, 1.5, True, 1)
+
+        assert entry["value"] == {"power": "on"}
+        assert entry.get("qos") == 1
+        assert entry.get("missing", "default") == "default"
+        assert entry.as_dict() == {
+            "value": {"power": "on"},
+            "timestamp": 1.5,
+            "retained": True,
+            "qos": 1
+        }
+
+        with pytest.raises(KeyError):
+            entry["as_dict"]